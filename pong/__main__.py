@@ -11,18 +11,27 @@ How to play: Move the windows so that the ball is always visible on at least
              To increase difficulty, buy a bigger monitor.
 """
 
+import time
+
+# Taken before anything else is imported, for the startup report
+START_TIME = time.time()
+
 import sys
 import os
-import time
 import math
-import pygame
 import getopt
 
 from itertools import repeat, chain
-from multiprocessing import Process, Pipe
-from collections import namedtuple
+import multiprocessing
+
+from collections import namedtuple, OrderedDict
 
-from . import messages, game, render, physics
+from . import messages, game, render, physics, channel, scene, wire
+from . import windowing, instrument, trajectory, clock, recording
+
+# How long it takes to get from starting up to the first frame, reported with
+# the frame stats
+STARTUP = instrument.StartupTimes(START_TIME)
 
 DEFAULT_TARGET_FPS = 60
 DEFAULT_INITIAL_BALL_SPEED = 70
@@ -33,6 +42,18 @@ DEFAULT_PADDLE_X = 50
 DEFAULT_PADDLE_SIZE = 30, 100
 DEFAULT_SCOREFILE_PATH = './score.txt'
 DEFAULT_MOVABLE_WINDOW_SIZE = 300, 300
+DEFAULT_STATS_INTERVAL = None
+DEFAULT_NUM_BALLS = 1
+DEFAULT_BROADCAST_FPS = None
+DEFAULT_PRESENT_FPS = None
+DEFAULT_PREDICT = False
+DEFAULT_BACKEND = 'process'
+DEFAULT_LISTEN_ADDRESS = '0.0.0.0:7777'
+
+# The renderables that windows move by themselves when predicting, see
+# `messages.predict`
+PREDICTED_BALL = 'ball'
+PREDICTED_FOLLOWERS = 'left_paddle', 'right_paddle'
 
 Options = namedtuple(
     'Options',
@@ -46,12 +67,32 @@ Options = namedtuple(
         'paddle_size',
         'scorefile_path',
         'display_size',
-        'movable_window_size'
+        'movable_window_size',
+        'stats_interval',
+        'num_balls',
+        'broadcast_fps',
+        'present_fps',
+        'predict',
+        'backend',
+        'record_path',
+        'listen_address',
     ]
 )
 
+# The windows for a game: lists of the channels to talk to them, the processes
+# running them, the `GameProcess` each was started with and the `WindowInfo`
+# each last reported (`None` until it has). Windows drawn by the game's own
+# process (see `pong.xrender`) or on other machines (see `pong.net`) have no
+# processes.
+WindowPool = namedtuple('WindowPool', ('chans', 'procs', 'layout', 'infos'))
+
+
+# Modules the fork server imports before it starts forking windows, see
+# `spawner`
+PREWARM_MODULES = ['pong.prewarm']
 
 DISPLAY_SIZE = None
+SPAWNER = None
 
 
 def memoized_display_size():
@@ -99,6 +140,14 @@ def options(**kwargs):
         scorefile_path=DEFAULT_SCOREFILE_PATH,
         movable_window_size=DEFAULT_MOVABLE_WINDOW_SIZE,
         display_size=None,
+        stats_interval=DEFAULT_STATS_INTERVAL,
+        num_balls=DEFAULT_NUM_BALLS,
+        broadcast_fps=DEFAULT_BROADCAST_FPS,
+        present_fps=DEFAULT_PRESENT_FPS,
+        predict=DEFAULT_PREDICT,
+        backend=DEFAULT_BACKEND,
+        record_path=None,
+        listen_address=DEFAULT_LISTEN_ADDRESS,
     )
 
     # Merge two dictionaries
@@ -112,40 +161,96 @@ def options(**kwargs):
     return Options(**out_args)
 
 
+def spawner():
+    """
+    Get the `multiprocessing` context to start windows with. Where there's a
+    fork server, every window is forked from it after it has imported
+    `PREWARM_MODULES`, so the imports (and anything else that can be done
+    before a window opens) happen once rather than once per window. This
+    process doesn't import `pygame` itself, so forking from it directly
+    wouldn't save any of that.
+
+    :return: A `multiprocessing` context, or the `multiprocessing` module
+             itself on Python 2
+    """
+
+    global SPAWNER
+
+    if SPAWNER is None:
+        try:
+            SPAWNER = multiprocessing.get_context('forkserver')
+        except (AttributeError, ValueError):
+            # Python 2 doesn't have contexts, and Windows doesn't have a fork
+            # server, so every window has to import everything for itself
+            SPAWNER = multiprocessing
+        else:
+            SPAWNER.set_forkserver_preload(PREWARM_MODULES)
+
+    return SPAWNER
+
+
 def subprocess(game_process):
     """
-    Create a subprocess that runs a `GameProcess`
+    Create a subprocess that runs a `GameProcess`. This doesn't wait for the
+    window to open, see `wait_for_windows`.
 
     :param game_process: An instance of `GameProcess`
-    :return:             A tuple of (pipe endpoint, process)
+    :return:             A tuple of (channel endpoint, process)
     """
 
-    my_conn, child_conn = Pipe()
+    context = spawner()
+    my_conn, child_conn = channel.pipe(
+        encode=wire.encode,
+        decode=wire.decode,
+        context=context,
+    )
 
-    proc = Process(target=game.run_process, args=(game_process, child_conn,))
+    proc = context.Process(
+        target=game.run_process,
+        args=(game_process, child_conn,),
+    )
     proc.start()
 
     return my_conn, proc
 
 
+def wait_for_windows(chans):
+    """
+    Wait for every window to open. Each window sends a `client_state` as soon
+    as it's open, and they're all started before any of them is waited for,
+    so they open in parallel and this takes as long as the slowest one.
+
+    :param chans: A list of `Channel`s to windows that were just started
+    :return:      A list of each window's first `WindowInfo`, or `None` for
+                  windows that quit instead
+    """
+
+    infos = list(repeat(None, len(chans)))
+
+    for index, msg in recv_until(chans):
+        infos[index] = get_client_state_or_default(msg, None)
+
+    return infos
+
+
 def display_size():
     """
-    Gets the width and height of the current display
+    Gets the width and height of the current display. This asks the
+    windowing system directly, rather than opening a fullscreen window to ask
+    `pygame`, so this process never has to import `pygame` at all.
 
     :return: A tuple of (width, height)
     """
 
-    # We have to open a window before `Info`, otherwise it grabs the whole
-    # screen and opening windows in the subprocesses stops working properly.
-    # No arguments means fullscreen by default.
-    pygame.display.set_mode()
+    return windowing.display_size()
 
-    info = pygame.display.Info()
-    out = info.current_w, info.current_h
 
-    # Close the window again, since we don't need it
-    pygame.display.quit()
-    return out
+def ball_ident(index):
+    """
+    The `Renderable.ident` for a ball. The first one is just 'ball', to match
+    the single-ball game.
+    """
+    return 'ball' if index == 0 else 'ball_{}'.format(index)
 
 
 def mk_renderables(
@@ -157,55 +262,75 @@ def mk_renderables(
     options,
     fps=None,
     time_left=None,
+    balls=None,
 ):
     """
     Builds the `Renderable` objects to send to the child processes for a given
-    frame.
+    frame. Each one gets a fixed `ident`, so that they can be diffed against
+    the previous frame's.
 
     :param ball_pos:      A two-element integer tuple of the position of the
-                          ball.
+                          ball. Ignored if `balls` is supplied
     :param score:         An integer of the game's current score
     :param highscore:     An integer of the player's current best score
     :param display_size:  An integer tuple of (display width, display height)
     :param fps:           An integer representing FPS, or None. If None, the
                           FPS counter will not be shown
+    :param balls:         A `multiball.Balls`, or `None` for the single ball
+                          at `ball_pos`
     :return:              A list of `Renderable`s
     """
 
     paddle_width, paddle_height = options.paddle_size
     half_paddle_height = paddle_height // 2
 
-    out = [
-        render.Circle(ball_pos, options.ball_radius),
+    if balls is None:
+        out = [render.Circle(ball_pos, options.ball_radius, ident='ball')]
+        left_paddle_y = right_paddle_y = ball_pos[1]
+    else:
+        out = [
+            render.Circle(position, radius, ident=ball_ident(index))
+            for index, (position, radius) in enumerate(
+                zip(balls.position_list(), balls.radii.tolist())
+            )
+        ]
+        left_paddle_y, right_paddle_y = balls.paddle_targets()
+
+    out.extend([
         render.Rectangle(
             (
                 options.paddle_x,
-                ball_pos[1] - half_paddle_height,
+                left_paddle_y - half_paddle_height,
             ),
             options.paddle_size,
+            ident='left_paddle',
         ),
         render.Rectangle(
             (
                 display_size[0] - options.paddle_x - paddle_width,
-                ball_pos[1] - half_paddle_height,
+                right_paddle_y - half_paddle_height,
             ),
             options.paddle_size,
+            ident='right_paddle',
         ),
         render.Text(
             (0, 0),
             "SCORE: {}".format(score),
+            ident='score',
         ),
         render.Text(
             (0, 20),
             "HIGH:  {}".format(highscore),
+            ident='highscore',
         ),
-    ]
+    ])
 
     if last_score is not None:
         out.append(
             render.Text(
                 (0, 40),
                 "LAST:  {}".format(last_score),
+                ident='last_score',
             )
         )
 
@@ -214,6 +339,7 @@ def mk_renderables(
             render.Text(
                 (display_size[0] - 90, 0),
                 "FPS: {}".format(fps),
+                ident='fps',
             )
         )
 
@@ -225,19 +351,47 @@ def mk_renderables(
                     display_size[1] // 2 + options.ball_radius,
                 ),
                 str(int(math.ceil(time_left))),
+                ident='countdown',
             )
         )
 
     return out
 
 
-def mk_windows(
+def paddle_window_size(display_size, options):
+    """
+    Gets the size of the immovable windows at the left- and right-hand sides of
+    the game area
+
+    :param display_size: A two-element integer tuple representing the total
+                         visible size of the game
+    :param options:      An `Options` object
+    :return:             A two-element integer tuple of (width, height)
+    """
+    return options.paddle_size[0] * 3, display_size[1]
+
+
+def present_fps(options):
+    """
+    How often the windows should draw. When they're predicting the ball they
+    have to draw on their own schedule, since nothing is sent while it moves.
+
+    :param options: An `Options` object
+    :return:        A frame rate, or `None` to draw whenever a frame arrives
+    """
+    if options.present_fps is None and options.predict:
+        return options.target_fps
+
+    return options.present_fps
+
+
+def window_layout(
     display_size,
     paddle_window_size,
     options,
 ):
     """
-    Spawns subprocesses with each of the game windows
+    Describes each of the game windows at the start of a game
 
     :param display_size:       A two-element integer tuple representing the
                                size of the display. This doesn't have to
@@ -248,8 +402,7 @@ def mk_windows(
                                immovable windows at the left- and right-hand
                                sides of the game area
     :param options:            An `Options` object
-    :return:                   A list of channels to communicate with the child
-                               processes
+    :return:                   A list of `GameProcess`es
     """
     # This game is actually unplayable with less than 2 windows, but
     # technically the code doesn't assume any more than 1, so if you want to be
@@ -260,17 +413,19 @@ def mk_windows(
         position=(0, 0),
         size=paddle_window_size,
         pinned=True,
+        present_fps=present_fps(options),
     )
 
     right_paddle_window = game.GameProcess(
         position=(display_size[0] - paddle_window_size[0], 0),
         size=paddle_window_size,
         pinned=True,
+        present_fps=present_fps(options),
     )
 
     out = [
-        subprocess(left_paddle_window),
-        subprocess(right_paddle_window),
+        left_paddle_window,
+        right_paddle_window,
     ]
 
     # NOTE: I calculate this manually instead of just using `centered=True` to
@@ -278,27 +433,143 @@ def mk_windows(
     #       at the start (since the game area may not be centered on the center
     #       of the screen, or SDL may not be able to request a centered window)
     out.append(
-        subprocess(
-            game.GameProcess(
-                position=(
-                    (display_size[0] - options.movable_window_size[0]) // 2,
-                    (display_size[1] - options.movable_window_size[1]) // 2,
-                ),
-                size=options.movable_window_size,
-            )
+        game.GameProcess(
+            position=(
+                (display_size[0] - options.movable_window_size[0]) // 2,
+                (display_size[1] - options.movable_window_size[1]) // 2,
+            ),
+            size=options.movable_window_size,
+            present_fps=present_fps(options),
         )
     )
 
-    movable_window = game.GameProcess(size=options.movable_window_size)
     # Subtract one, because the first one is the centered one on the previous
     # line
-    out.extend(
-        map(
-            subprocess,
-            repeat(movable_window, options.num_movable_windows - 1)
+    num_uncentered = options.num_movable_windows - 1
+
+    if windowing.is_headless():
+        # There's no window manager to place these for us, so tile them across
+        # the display. With enough windows this covers the whole game area, so
+        # the game can keep going without anyone moving anything.
+        out.extend(
+            game.GameProcess(
+                position=position,
+                size=options.movable_window_size,
+                present_fps=present_fps(options),
+            )
+            for position in windowing.headless.tile_positions(
+                display_size,
+                options.movable_window_size,
+                num_uncentered,
+            )
         )
+    else:
+        movable_window = game.GameProcess(
+            size=options.movable_window_size,
+            present_fps=present_fps(options),
+        )
+        out.extend(repeat(movable_window, num_uncentered))
+
+    return out
+
+
+def mk_window_pool(display_size, options):
+    """
+    Spawns subprocesses with each of the game windows, or with the 'xlib'
+    backend opens them all in this process, or with the 'net' backend waits
+    for them to connect. The pool can be reused across games with
+    `reset_window_pool`, which is much quicker than spawning new processes
+    (and opening new windows) for every game.
+
+    :param display_size: A two-element integer tuple representing the size of
+                         the display (see `window_layout`)
+    :param options:      An `Options` object
+    :return:             A `WindowPool`
+    """
+    layout = window_layout(
+        display_size,
+        paddle_window_size(display_size, options),
+        options=options,
     )
 
+    if options.backend == 'xlib':
+        if windowing.is_headless() or windowing.is_windows():
+            raise ValueError('The xlib backend needs an X display')
+
+        # Imported here so that only this backend needs it
+        from . import xrender
+
+        chans, procs = xrender.open_windows(layout), []
+        infos = list(repeat(None, len(chans)))
+    elif options.backend == 'net':
+        from . import net
+
+        chans = net.serve_windows(
+            options.listen_address,
+            layout,
+            out=sys.stderr,
+        )
+        procs = []
+        infos = wait_for_windows(chans)
+    elif options.backend == 'process':
+        chans, procs = unzip(map(subprocess, layout))
+        infos = wait_for_windows(chans)
+    else:
+        raise ValueError('Unknown backend {}'.format(options.backend))
+
+    return WindowPool(chans=chans, procs=procs, layout=layout, infos=infos)
+
+
+def reset_window_pool(pool):
+    """
+    Gets the windows in a pool ready for a new game, moving the ones with a
+    fixed starting position back to it.
+
+    :param pool: A `WindowPool`
+    """
+    for index, (chan, game_process) in enumerate(
+        zip(pool.chans, pool.layout)
+    ):
+        # Replace the last game's frame first, in case the window hasn't read
+        # it yet, so that the window doesn't draw it after resetting
+        chan.send_frame([])
+        chan.send([messages.reset(game_process.position)])
+
+        info = pool.infos[index]
+
+        if game_process.position is not None and info is not None:
+            pool.infos[index] = info._replace(
+                x=game_process.position[0],
+                y=game_process.position[1],
+            )
+
+
+def close_window_pool(pool):
+    """
+    Tells every window in a pool to quit
+
+    :param pool: A `WindowPool`
+    """
+    for chan in pool.chans:
+        chan.send([messages.quit()])
+
+
+def dropped_frames(chans):
+    """
+    Count the frames each window was too slow to read before the next one
+    replaced it
+
+    :param chans: A list of `Channel`s to windows
+    :return:      An `OrderedDict` of the total, then a count for each window
+                  that dropped any
+    """
+    counts = [chan.frames_dropped() for chan in chans]
+    out = OrderedDict([('frames dropped', sum(counts))])
+
+    for index, count in enumerate(counts):
+        if count:
+            out['window {} dropped'.format(index)] = count
+
     return out
 
 
@@ -335,21 +606,124 @@ def try_recv(chan, consume=False):
         return None
 
 
+def recv_until(chans, deadline=None, now=time.time):
+    """
+    Wait for messages from the windows, yielding each window's latest message
+    as soon as it arrives. This sleeps until there's something to read (or the
+    deadline passes) instead of polling every channel.
+
+    :param chans:    A list of `Channel`s
+    :param deadline: A time to stop waiting at, or `None` to wait until every
+                     channel has sent something
+    :param now:      The clock that `deadline` is on
+    :return:         An iterator of tuples of (index in `chans`, message)
+    """
+    indices = dict((chan, index) for index, chan in enumerate(chans))
+    waiting = set(chans)
+
+    while waiting:
+        if deadline is None:
+            timeout = None
+        else:
+            timeout = deadline - now()
+
+            if timeout <= 0:
+                return
+
+        ready = channel.wait(waiting, timeout)
+
+        for chan in ready:
+            if deadline is None:
+                waiting.discard(chan)
+
+            yield indices[chan], messages.consume_connection_buffer(chan)
+
+
+def visible_renderables(renderables, window_info, margin=0, keep=()):
+    """
+    Filters a list of `Renderable`s down to the ones that would actually draw
+    something inside a given window.
+
+    :param renderables: A list of `Renderable`s
+    :param window_info: The window's last known `WindowInfo`, or `None` if we
+                        don't know where it is yet (in which case nothing is
+                        filtered out)
+    :param margin:      How far outside the window to keep renderables, for
+                        ones that might move into it before the next frame
+    :param keep:        Idents of renderables to keep wherever they are
+    :return:            A list of `Renderable`s
+    """
+    if window_info is None:
+        return renderables
+
+    window_rect = (
+        window_info.x - margin,
+        window_info.y - margin,
+        window_info.width + margin * 2,
+        window_info.height + margin * 2,
+    )
+
+    return [
+        renderable
+        for renderable in renderables
+        if renderable.ident in keep or
+        physics.intersects(renderable.bounds(), window_rect)
+    ]
+
+
+def index_windows(window_infos, window_index=None):
+    """
+    Bring a spatial index of the windows up to date with their latest
+    `WindowInfo`s. Windows are keyed by their position in `window_infos`, and
+    only the ones that moved are re-indexed.
+
+    :param window_infos: A list of `WindowInfo`s, or `None` for windows whose
+                         position isn't known yet
+    :param window_index: A `physics.GridIndex` to update, or `None` to make a
+                         new one
+    :return:             The `physics.GridIndex`
+    """
+    if window_index is None:
+        window_index = physics.GridIndex()
+
+    for index, info in enumerate(window_infos):
+        if info is None:
+            window_index.update(index, None)
+        else:
+            window_index.update(
+                index,
+                (info.x, info.y, info.width, info.height),
+            )
+
+    return window_index
+
+
 # TODO: Should this call `mk_renderables` instead of taking it as an argument?
-def update_windows(windows, renderables, ball_pos, should_block=False):
+def update_windows(
+    windows,
+    renderables,
+    ball_positions,
+    should_block=False,
+    stats=instrument.NullFrameStats(),
+    window_index=None,
+    timestamp=None,
+    margin=0,
+    keep=(),
+):
     """
     Sends one tick's worth of messages to the child windows, and return the
-    result. It will freeze/unfreeze children based on the ball's position, and
-    render all the objects on screen.
-
-    NOTE: If one of the processes is not responding to messages this will
-          block after a couple of seconds as the connection's buffer fills up.
-          The correct way to fix this is to use a version of connection that
-          has a ring buffer instead of a blocking buffer. There doesn't seem to
-          be a process-aware non-blocking ring buffer in Python's stdlib
-          (`collections.deque` comes close, but is single-process only, and
-          `multiprocessing.Queue` blocks when full) and writing one is out of
-          scope for this project.
+    result. It will freeze/unfreeze children based on the balls' positions, and
+    render all the objects on screen. Each window is only sent the objects
+    that overlap it, going by the last `WindowInfo` it reported, and only
+    those that changed since the last scene it was sent.
+
+    NOTE: Each window is sent one frame per tick (see `pong.channel`), and a
+          frame the window hasn't read yet is replaced by the next one
+          instead of queueing behind it. That way one process not responding
+          can't block the whole loop, and only that window drops frames.
+          Since the render messages are deltas against the last frame the
+          window read, we send the whole scene whenever we're replacing an
+          unread frame.
 
           Keeping this update loop non-blocking is actually really important,
           because `pygame` (maybe `SDL`?) will block when moving the window on
@@ -357,46 +731,90 @@ def update_windows(windows, renderables, ball_pos, should_block=False):
           although it could probably be circumvented if `pygame`/`SDL` was
           designed with it in mind.
 
-    :param windows:     A list of two-element tuples (channel, window info)
-    :param renderables: A list of `Renderable`s. These must be picklable
-    :param ball_pos:    A two element tuple of the ball's current position
-    :return:            A list of responses from the windows
+    :param windows:        A list of three-element tuples (channel, window
+                           info, last sent scene). The scene should be `None`
+                           if the window has never been sent one, or if it
+                           might not have the last one (e.g. after a reset)
+    :param renderables:    A list of `Renderable`s. These must be encodable by
+                           `pong.wire`
+    :param ball_positions: A list of two element tuples of every ball's
+                           current position. Windows are frozen if any ball is
+                           inside them
+    :param stats:          A `FrameStats` to record the time spent sending to
+                           each window and receiving from all of them in
+    :param window_index:   The windows' `GridIndex` (see `index_windows`), or
+                           `None` to build one from the window infos
+    :param timestamp:      The `clock.monotonic` time the renderables are a
+                           snapshot of, or `None` to leave it out
+    :param margin:         How far outside each window to send renderables
+                           from (see `visible_renderables`)
+    :param keep:           Idents of renderables to send to every window
+    :return:               A tuple of (list of responses from the windows, list
+                           of scenes sent to the windows)
     """
 
-    for (chan, infos) in windows:
-        if infos is not None and physics.contains(
-            inner=ball_pos,
-            outer=(infos.x, infos.y, infos.width, infos.height),
-        ):
+    sent_scenes = []
+
+    if window_index is None:
+        window_index = index_windows([infos for _, infos, _ in windows])
+
+    occupied = window_index.occupied(ball_positions)
+
+    for index, (chan, infos, last_scene) in enumerate(windows):
+        send_start = time.time()
+
+        if index in occupied:
             to_send = [messages.freeze()]
         else:
             to_send = [messages.unfreeze()]
 
-        to_send.append(messages.render(renderables))
+        if timestamp is not None:
+            to_send.append(messages.timestamp(timestamp))
+
+        new_scene = scene.from_renderables(
+            visible_renderables(renderables, infos, margin, keep)
+        )
+
+        render_msg = scene.diff(
+            None if chan.frame_pending() else last_scene,
+            new_scene,
+        )
+
+        if render_msg is not None:
+            to_send.append(render_msg)
+
+        chan.send_frame(to_send)
+        sent_scenes.append(new_scene)
 
-        chan.send(to_send)
+        stats.record('send', time.time() - send_start)
+
+    recv_start = time.time()
 
     # Pass this to `list` to force all the `recv` calls at the same time (to
     # avoid confusing behaviour if we pass this to a function that doesn't
     # consume the whole list, or suchlike).
-    # Additionally, we use blocking `recv` if there is no existing window info,
-    # since we can't do anything at all if we've never received window size/pos
-    # information for a given window. Otherwise, non-blocking `recv` is used.
+    # Additionally, we wait for every window to respond if there is no existing
+    # window info, since we can't do anything at all if we've never received
+    # window size/pos information for a given window. The windows are waited
+    # on all at once, so this takes as long as the slowest one rather than the
+    # sum of all of them. Otherwise, non-blocking `recv` is used.
     if should_block:
-        return list(
-            map(
-                lambda window: messages.consume_connection_buffer(window[0]),
-                windows,
-            )
-        )
+        responses = [None] * len(windows)
+
+        for index, response in recv_until([chan for chan, _, _ in windows]):
+            responses[index] = response
     else:
-        return list(
+        responses = list(
             map(
                 lambda chan: try_recv(chan[0], consume=True),
                 windows,
             )
         )
 
+    stats.record('recv', time.time() - recv_start)
+
+    return responses, sent_scenes
+
 
 def play_area(display_size, options):
     """
@@ -441,6 +859,18 @@ def handle_ball_physics(position, speed, direction, dt, play_area):
     return out_pos, out_dir, inc_score
 
 
+def ball_speed(score, options):
+    """
+    :param score:   The current score
+    :param options: An `Options` object
+    :return:        The speed of the ball at that score
+    """
+    return (
+        options.initial_ball_speed +
+        score * options.ball_speed_score_multiplier
+    )
+
+
 def rolling_average(average, current, multiplier=0.1):
     """
     Calculate a rolling average by adding a proportion of the difference with
@@ -472,37 +902,100 @@ def get_client_state_or_default(message, default):
     return message.info if messages.is_client_state(message) else default
 
 
-def run_game(last_score, highscore, options=options()):
+def game_display_size(options):
     """
-    Run a single instance of the game, and tear down when finished.
+    Gets the size of the game area, either from the options or the display
 
-    :param highscore: The maximum score acheived by the player.
-    :param options:   An `Options` object
+    :param options: An `Options` object
+    :return:        An integer tuple of (width, height)
     """
-
-    display_size = (
+    return (
         options.display_size
         if options.display_size is not None
         else memoized_display_size()
     )
+
+
+def run_game(
+    last_score,
+    highscore,
+    options=options(),
+    pool=None,
+    recorder=None,
+    replay=None,
+):
+    """
+    Run a single instance of the game. If no window pool is supplied the
+    windows are spawned for this game and torn down when finished, otherwise
+    the pool's windows are reset and left open for the next game (unless the
+    player quit).
+
+    When replaying a recording, the frame lengths and the windows' states come
+    from the recording instead of the clock and the windows, and the game runs
+    as fast as it can. The pool's windows should be `NullWindow`s.
+
+    :param highscore: The maximum score acheived by the player.
+    :param options:   An `Options` object
+    :param pool:      A `WindowPool` made with the same options, or `None`.
+                      The game starts from the window states in its `infos`,
+                      and leaves the windows' latest states there
+    :param recorder:  A `recording.Recorder` to record the game with, or
+                      `None`
+    :param replay:    A `recording.GameReplay` to replay instead of playing,
+                      or `None`
+    :return:          The score, or `None` if the player quit (or the
+                      recording ran out)
+    """
+
+    display_size = game_display_size(options)
     frame_length = 1.0 / options.target_fps
-    paddle_width = options.paddle_size[0]
     pause_time = 3
 
     ball_pos = display_size[0] // 2, display_size[1] // 2
     ball_dir = 1, 1
-    pad_window_size = paddle_width * 3, display_size[1]
 
-    chans, procs = unzip(
-        mk_windows(
-            display_size,
-            pad_window_size,
-            options=options,
+    # Anything random has to come out the same when the game is replayed
+    if replay is not None:
+        seed = replay.seed
+    elif recorder is not None:
+        seed = recorder.start_game(last_score, highscore)
+    else:
+        seed = None
+
+    if options.num_balls > 1:
+        # Imported here so that NumPy is only needed for multiball games
+        from . import multiball
+
+        balls = multiball.Balls.spawn(
+            options.num_balls,
+            ball_pos,
+            options.ball_radius,
+            seed=seed,
         )
-    )
+    else:
+        balls = None
+
+    owns_pool = pool is None
+
+    if owns_pool:
+        pool = mk_window_pool(display_size, options=options)
+    else:
+        reset_window_pool(pool)
+
+    chans, procs = pool.chans, pool.procs
+
+    # What the windows said when they opened (or at the end of the last
+    # game), so the first frame only has to wait for the ones that haven't
+    # said anything yet. A replay has them in its first tick.
+    if replay is None:
+        window_infos = list(pool.infos)
+    else:
+        window_infos = list(repeat(None, len(chans)))
 
-    window_infos = list(repeat(None, len(chans)))
+    window_scenes = list(repeat(None, len(chans)))
+    window_index = index_windows(window_infos)
     first_iteration = True
+    quit_received = False
 
     # Instead of recalculating the borders offset with the ball radius, just
     # calculate them once here. A ball of radius R bouncing off a rectangle of
@@ -511,88 +1004,270 @@ def run_game(last_score, highscore, options=options()):
     ball_area_rect = play_area(display_size, options=options)
 
     score = 0
-    last_time = time.time() - frame_length
+    game_time = 0.0
+    ball_path = trajectory.Trajectory(
+        position=ball_pos,
+        direction=ball_dir,
+        speed=ball_speed(score, options),
+        play_area=ball_area_rect,
+    )
     avg_fps = options.target_fps
 
+    if options.stats_interval is None:
+        stats = instrument.NullFrameStats()
+    else:
+        stats = instrument.FrameStats(
+            frame_length,
+            report_interval=options.stats_interval,
+            clock=clock.monotonic,
+            counters=lambda: dropped_frames(chans),
+        )
+
+    if replay is None:
+        scheduler = clock.FrameScheduler(frame_length, stats=stats)
+    else:
+        scheduler = recording.ReplayScheduler(replay, frame_length)
+
+    last_time = scheduler.clock() - frame_length
+
+    # Physics runs every frame, but the windows can be sent frames less often
+    # than that and left to interpolate between them
+    if options.broadcast_fps is None:
+        broadcast_interval = frame_length
+    else:
+        broadcast_interval = 1.0 / options.broadcast_fps
+
+    next_broadcast = None
+
+    # Only a single ball can be predicted, since the windows only know how to
+    # move the paddles for one
+    predicting = options.predict and balls is None
+    predicted_path = None
+    predicted_position = None
+
+    # The window states that arrived between the last frame and this one, or
+    # that the game started with
+    updates = [
+        (index, info)
+        for index, info in enumerate(window_infos)
+        if info is not None
+    ]
+
     while True:
-        cur_time = time.time()
-        dt = cur_time - last_time
+        cur_time = scheduler.start_frame()
+        stats.start_frame()
+
+        if replay is None:
+            dt = cur_time - last_time
+        elif scheduler.tick is None:
+            close_window_pool(pool)
+            stats.report()
+
+            return None
+        else:
+            # Use exactly what the game did, rather than letting rounding
+            # errors in the replay's clock nudge the ball
+            dt = scheduler.tick.dt
+            updates = scheduler.tick.updates
+
+            for index, info in updates:
+                window_infos[index] = info
+
+            index_windows(window_infos, window_index)
+
         fps = 1.0 / dt
         avg_fps = rolling_average(avg_fps, fps)
         last_time = cur_time
 
-        while dt > 0:
-            step_dt = min(dt, frame_length)
+        if pause_time is None:
+            play_dt = dt
+        else:
+            pause_time -= dt
+
+            if pause_time <= 0:
+                # The ball starts moving partway through this frame
+                play_dt = -pause_time
+                pause_time = None
+            else:
+                play_dt = 0
+
+        if balls is None:
+            game_time += play_dt
+
+            # Each bounce off a paddle happens at exactly `bounce_time`, so
+            # however long the frame was the ball can't skip past an edge
+            while ball_path.bounce_time <= game_time:
+                score += 1
+                ball_path = ball_path.bounce(ball_speed(score, options))
 
-            if pause_time is None:
-                ball_speed = (
-                    options.initial_ball_speed +
-                    score * options.ball_speed_score_multiplier
+            ball_pos = ball_path.position_at(game_time)
+        else:
+            while play_dt > 0:
+                score += balls.step(
+                    ball_speed(score, options),
+                    min(play_dt, frame_length),
+                    ball_area_rect,
                 )
+                play_dt -= frame_length
 
-                ball_pos, ball_dir, inc_score = handle_ball_physics(
-                    position=ball_pos,
-                    speed=ball_speed,
-                    direction=ball_dir,
-                    dt=step_dt,
-                    play_area=ball_area_rect,
+        if balls is None:
+            ball_positions = [ball_pos]
+        else:
+            ball_positions = balls.position_list()
+
+        stats.lap('physics')
+
+        if predicting:
+            # The ball only changes course when it starts moving or bounces
+            # off a paddle (which replaces `ball_path`), so that's the only
+            # time the windows need telling. Otherwise we keep sending the
+            # same renderables for it, so only the windows' HUDs change.
+            moving_path = ball_path if pause_time is None else None
+
+            if predicted_position is None or moving_path is not predicted_path:
+                if moving_path is None:
+                    segment = trajectory.Trajectory(
+                        position=ball_pos,
+                        direction=ball_dir,
+                        speed=0,
+                        play_area=ball_area_rect,
+                    )
+                    segment_start = cur_time
+                else:
+                    segment = moving_path
+                    segment_start = cur_time - (game_time - segment.start)
+
+                predict_msg = messages.predict(
+                    segment,
+                    segment_start,
+                    PREDICTED_BALL,
+                    PREDICTED_FOLLOWERS,
                 )
 
-                if inc_score:
-                    score += 1
-            else:
-                pause_time -= step_dt
-
-                if pause_time <= 0:
-                    pause_time = None
-
-            dt -= frame_length
-
-        renderables = mk_renderables(
-            ball_pos=ball_pos,
-            score=score,
-            highscore=highscore,
-            last_score=last_score,
-            display_size=display_size,
-            options=options,
-            fps=int(round(avg_fps)),
-            time_left=pause_time,
-        )
+                for chan in chans:
+                    chan.send([predict_msg])
 
-        msgs = update_windows(
-            windows=zip(chans, window_infos),
-            renderables=renderables,
-            ball_pos=ball_pos,
-            should_block=first_iteration,
-        )
+                predicted_path = moving_path
+                predicted_position = segment.position
+
+            shown_ball_pos = predicted_position
+            keep = (PREDICTED_BALL,) + PREDICTED_FOLLOWERS
+        else:
+            shown_ball_pos = ball_pos
+            keep = ()
 
-        window_infos = map(
-            lambda tup: get_client_state_or_default(*tup),
-            zip(msgs, window_infos),
+        if replay is None:
+            broadcast = next_broadcast is None or cur_time >= next_broadcast
+        else:
+            broadcast = scheduler.tick.broadcast
+
+        frozen = []
+
+        if broadcast:
+            if recorder is not None or replay is not None:
+                frozen = sorted(window_index.occupied(ball_positions))
+
+            renderables = mk_renderables(
+                ball_pos=shown_ball_pos,
+                score=score,
+                highscore=highscore,
+                last_score=last_score,
+                display_size=display_size,
+                options=options,
+                fps=int(round(avg_fps)),
+                time_left=pause_time,
+                balls=balls,
+            )
+
+            stats.lap('renderables')
+
+            # Windows draw the ball up to a broadcast behind or ahead of where
+            # it is now (see `GameProcess`), so send it to windows it's about
+            # to reach too
+            msgs, window_scenes = update_windows(
+                windows=list(zip(chans, window_infos, window_scenes)),
+                renderables=renderables,
+                ball_positions=ball_positions,
+                should_block=(
+                    first_iteration and
+                    replay is None and
+                    any(info is None for info in window_infos)
+                ),
+                stats=stats,
+                window_index=window_index,
+                timestamp=cur_time,
+                margin=ball_speed(score, options) * broadcast_interval * 2,
+                keep=keep,
+            )
+
+            if next_broadcast is None:
+                next_broadcast = cur_time
+
+            next_broadcast += broadcast_interval
+
+            # Don't try to catch up on broadcasts we were too slow for
+            if next_broadcast <= cur_time:
+                next_broadcast = cur_time + broadcast_interval
+        else:
+            msgs = list(repeat(None, len(chans)))
+
+        if replay is not None:
+            msgs = list(repeat(None, len(chans)))
+
+            for index, info in scheduler.tick.responses:
+                msgs[index] = messages.client_state(info)
+
+        stats.mark()
+
+        window_infos = list(
+            map(
+                lambda tup: get_client_state_or_default(*tup),
+                zip(msgs, window_infos),
+            )
         )
+        index_windows(window_infos, window_index)
 
         # Don't check if game is lost if the game hasn't started yet - this is
         # mostly so you don't get stuck in an infinite loop if the ball doesn't
         # spawn in a window for whatever reason
-        game_lost = pause_time is None and not physics.any_contains(
-            inner=ball_pos,
-            outers=map(
-                lambda info: (info.x, info.y, info.width, info.height),
-                window_infos,
-            )
+        game_lost = pause_time is None and not all(
+            window_index.any_containing(position)
+            for position in ball_positions
         )
 
         # NOTE: Ideally we'd only use message-passing here to exit gracefully,
         #       but we can't handle SIGHUP and friends so we'll exit if one of
         #       our children dies unexpectedly
-        ended = game_lost or (
+        ended = game_lost or quit_received or (
             any(filter(messages.is_quit, msgs)) or
             any(filter(lambda p: not p.is_alive(), procs))
         )
 
+        stats.lap('containment')
+
+        if recorder is not None or replay is not None:
+            tick = recording.Tick(
+                broadcast=broadcast,
+                dt=dt,
+                score=score,
+                ball_positions=ball_positions,
+                frozen=frozen,
+                responses=recording.client_states(enumerate(msgs)),
+                updates=updates,
+            )
+
+            if recorder is not None:
+                recorder.record_tick(tick)
+            else:
+                replay.check(tick)
+
         if ended:
-            for chan in chans:
-                chan.send([messages.quit()])
+            pool.infos[:] = window_infos
+
+            if owns_pool or not game_lost:
+                close_window_pool(pool)
+
+            stats.report()
 
             if game_lost:
                 return score
@@ -601,9 +1276,46 @@ def run_game(last_score, highscore, options=options()):
         else:
             pass
 
-        post_time = time.time()
-        process_time = post_time - cur_time
-        time.sleep(max(frame_length - process_time, 0))
+        process_time = scheduler.clock() - cur_time
+        stats.end_frame(process_time)
+        stats.maybe_report()
+
+        stats.mark()
+
+        # Instead of sleeping until the next frame, take in the windows' states
+        # as they arrive, so that the next frame starts from the freshest
+        # positions we can get. Waiting on the channels isn't very precise, so
+        # stop a little early and let the scheduler spin the rest of the way.
+        # A replay takes them from the next tick instead.
+        updates = []
+
+        for index, msg in recv_until(
+            [] if replay is not None else chans,
+            deadline=scheduler.deadline - scheduler.spin_time,
+            now=scheduler.clock,
+        ):
+            if messages.is_quit(msg):
+                quit_received = True
+                break
+
+            if messages.is_client_state(msg):
+                updates.append((index, msg.info))
+
+            window_infos[index] = get_client_state_or_default(
+                msg,
+                window_infos[index],
+            )
+
+        index_windows(window_infos, window_index)
+        scheduler.wait()
+
+        stats.lap('wait')
+
+        if first_iteration and 'first frame' not in STARTUP.milestones:
+            STARTUP.mark('first frame')
+
+            if options.stats_interval is not None and replay is None:
+                STARTUP.report()
 
         first_iteration = False
 
@@ -706,6 +1418,72 @@ if __name__ == '__main__':
             'Set the display size of the game - if not set, will be inferred',
             in_output=True,
         ),
+        CmdFlags(
+            'f', 'fps', 'target_fps', int,
+            'Set the frame rate the game runs at (default {})'.format(
+                DEFAULT_TARGET_FPS
+            ),
+            in_output=True,
+        ),
+        CmdFlags(
+            't', 'stats', 'stats_interval', float,
+            'Time each stage of every frame, and print a summary to stderr '
+            'every this many seconds and when each game ends (0 for only '
+            'when each game ends)',
+            in_output=True,
+        ),
+        CmdFlags(
+            'r', 'broadcast', 'broadcast_fps', float,
+            'Send the windows frames this many times a second, instead of '
+            'every frame',
+            in_output=True,
+        ),
+        CmdFlags(
+            'p', 'present', 'present_fps', float,
+            'Have each window draw this many times a second, interpolating '
+            'between the frames it is sent, instead of drawing each frame '
+            'as it arrives',
+            in_output=True,
+        ),
+        CmdFlags(
+            'e', 'predict', 'predict', lambda val: val not in ('', '0'),
+            'Set to 1 to have the windows move the ball and paddles by '
+            'themselves, only telling them when the ball bounces (single '
+            'ball only)',
+            in_output=True,
+        ),
+        CmdFlags(
+            'x', 'backend', 'backend', str,
+            'Set to "xlib" to draw every window from the game process '
+            'directly instead of running a process per window (X11 only), or '
+            'to "net" to wait for windows to connect with `python -m '
+            'pong.client` (default "{}")'.format(
+                DEFAULT_BACKEND
+            ),
+            in_output=True,
+        ),
+        CmdFlags(
+            'n', 'listen', 'listen_address', str,
+            'Set the address to wait for windows on with the "net" backend '
+            '(default {})'.format(
+                DEFAULT_LISTEN_ADDRESS
+            ),
+            in_output=True,
+        ),
+        CmdFlags(
+            'c', 'record', 'record_path', str,
+            'Record every tick of every game to this file, to be replayed '
+            'with `python -m pong.replay`',
+            in_output=True,
+        ),
+        CmdFlags(
+            'b', 'balls', 'num_balls', int,
+            'Set number of balls (default {}). More than one needs '
+            'NumPy'.format(
+                DEFAULT_NUM_BALLS
+            ),
+            in_output=True,
+        ),
         CmdFlags(
             short_help, long_help, None, None,
             'Show this message',
@@ -764,6 +1542,7 @@ if __name__ == '__main__':
     )
 
     options = options(**opts_args)
+    STARTUP.mark('imports')
 
     high = 0
     if os.path.isfile(options.scorefile_path):
@@ -771,14 +1550,36 @@ if __name__ == '__main__':
             high = int(score_file.read())
 
     score = None
+    game_size = game_display_size(options)
+    STARTUP.mark('display size')
+
+    pool = mk_window_pool(game_size, options=options)
+    STARTUP.mark('windows ready')
+
+    if options.record_path is None:
+        recorder = None
+    else:
+        # Record the display size too, so the replay doesn't need a display
+        recorder = recording.Recorder(
+            open(options.record_path, 'wb'),
+            dict(
+                options._replace(
+                    display_size=game_size,
+                    record_path=None,
+                )._asdict()
+            ),
+        )
 
     while True:
-        score = run_game(score, high, options)
+        score = run_game(score, high, options, pool=pool, recorder=recorder)
 
         if score is None:
             break
 
         high = max(score, high)
 
+    if recorder is not None:
+        recorder.close()
+
     with open('score.txt', 'w') as score_file:
         score_file.write(str(high))
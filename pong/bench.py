@@ -0,0 +1,478 @@
+"""
+Benchmarks for each stage of the frame pipeline. Run with
+`python -m pong.bench`, use `--help` for the options.
+
+Every stage is timed in isolation, once per frame, and reported as
+percentiles in microseconds. `update_windows` is run against real window
+processes for each of the requested window counts, which is where the loop
+eventually stops fitting in a frame. Results are written as JSON so they can
+be diffed between commits.
+
+This runs headless (see `pong.windowing.headless`) unless `PONG_HEADLESS=0`
+is set, in which case real windows are opened.
+"""
+
+import os
+
+# This has to happen before anything imports `pong.windowing`
+os.environ.setdefault('PONG_HEADLESS', '1')
+
+# The results go to stdout, so keep `pygame`'s banner out of it. The windows'
+# processes (and the fork server they come from) inherit this.
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import getopt
+import json
+import pickle
+import platform
+import sys
+import timeit
+
+from itertools import repeat
+
+from . import messages, wire, game, windowing, trajectory
+from .__main__ import (
+    mk_renderables,
+    options,
+    play_area,
+    handle_ball_physics,
+    ball_speed,
+    mk_window_pool,
+    close_window_pool,
+    update_windows,
+    get_client_state_or_default,
+    typed_tuple,
+)
+
+BENCH_DISPLAY_SIZE = 1920, 1080
+DEFAULT_FRAMES = 1000
+DEFAULT_REPEAT = 5
+DEFAULT_WINDOW_COUNTS = 2, 50, 500
+STAGES = (
+    'mk_renderables',
+    'handle_ball_physics',
+    'trajectory',
+    'update_windows',
+    'render',
+    'get_win_info',
+    'wire',
+)
+
+timer = timeit.default_timer
+
+
+def percentile(sorted_samples, p):
+    """
+    Nearest-rank percentile
+
+    :param sorted_samples: A non-empty sorted list of numbers
+    :param p:              The percentile, between 0 and 100
+    :return:               An element of `sorted_samples`
+    """
+    index = int(round(p / 100.0 * (len(sorted_samples) - 1)))
+    return sorted_samples[index]
+
+
+def summarise(samples):
+    """
+    Summarise a list of timings
+
+    :param samples: A non-empty list of durations, in seconds
+    :return:        A dictionary of statistics, in microseconds
+    """
+    sorted_samples = sorted(samples)
+
+    return dict(
+        count=len(samples),
+        mean_us=sum(samples) * 1e6 / len(samples),
+        p50_us=percentile(sorted_samples, 50) * 1e6,
+        p99_us=percentile(sorted_samples, 99) * 1e6,
+        max_us=sorted_samples[-1] * 1e6,
+    )
+
+
+def ball_position(frame, display_size=BENCH_DISPLAY_SIZE):
+    """
+    A deterministic ball path that bounces all over the display
+    """
+    return (
+        frame * 7.5 % display_size[0],
+        frame * 4.5 % display_size[1],
+    )
+
+
+def frame_renderables(frame, opts, display_size=BENCH_DISPLAY_SIZE):
+    return mk_renderables(
+        ball_pos=ball_position(frame, display_size),
+        score=frame // 100,
+        highscore=42,
+        last_score=7,
+        display_size=display_size,
+        options=opts,
+        fps=60 + frame % 3,
+    )
+
+
+def sample_frames(num_frames, display_size=BENCH_DISPLAY_SIZE):
+    """
+    Build a list of realistic server-to-client payloads, with every renderable
+    being sent on every frame (i.e. the worst case, where nothing could be
+    culled or diffed away).
+
+    :param num_frames:   The number of payloads to build
+    :param display_size: An integer tuple of (display width, display height)
+    :return:             A list of lists of `Message`s
+    """
+    opts = options()
+
+    return [
+        [
+            messages.unfreeze(),
+            messages.render(
+                frame_renderables(frame, opts, display_size),
+                reset=True,
+            ),
+        ]
+        for frame in range(num_frames)
+    ]
+
+
+def bench_codec(encode, decode, frames, repeat=DEFAULT_REPEAT):
+    """
+    Time encoding and decoding a list of payloads
+
+    :param encode: A function turning a payload into bytes
+    :param decode: The inverse of `encode`
+    :param frames: A list of payloads
+    :param repeat: How many times to repeat the timing, the best is taken
+    :return:       A dictionary of results, with times in microseconds
+    """
+    encoded = [encode(frame) for frame in frames]
+
+    encode_time = min(
+        timeit.repeat(
+            lambda: [encode(frame) for frame in frames],
+            number=1,
+            repeat=repeat,
+        )
+    )
+    decode_time = min(
+        timeit.repeat(
+            lambda: [decode(data) for data in encoded],
+            number=1,
+            repeat=repeat,
+        )
+    )
+
+    return dict(
+        bytes_per_frame=float(sum(map(len, encoded))) / len(frames),
+        encode_us=encode_time * 1e6 / len(frames),
+        decode_us=decode_time * 1e6 / len(frames),
+    )
+
+
+def bench_wire(num_frames=DEFAULT_FRAMES, repeat=DEFAULT_REPEAT):
+    """
+    Compare `pong.wire` with pickling the same messages
+
+    :return: A dictionary of codec name to `bench_codec` results
+    """
+    frames = sample_frames(num_frames)
+
+    return dict(
+        pickle=bench_codec(
+            lambda obj: pickle.dumps(obj, pickle.HIGHEST_PROTOCOL),
+            pickle.loads,
+            frames,
+            repeat=repeat,
+        ),
+        wire=bench_codec(wire.encode, wire.decode, frames, repeat=repeat),
+    )
+
+
+def bench_mk_renderables(num_frames):
+    opts = options()
+    samples = []
+
+    for frame in range(num_frames):
+        start = timer()
+        frame_renderables(frame, opts)
+        samples.append(timer() - start)
+
+    return summarise(samples)
+
+
+def bench_handle_ball_physics(num_frames):
+    opts = options()
+    area = play_area(BENCH_DISPLAY_SIZE, opts)
+    frame_length = 1.0 / opts.target_fps
+
+    position = BENCH_DISPLAY_SIZE[0] // 2, BENCH_DISPLAY_SIZE[1] // 2
+    direction = 1, 1
+    speed = opts.initial_ball_speed
+    samples = []
+
+    for _ in range(num_frames):
+        start = timer()
+        position, direction, inc_score = handle_ball_physics(
+            position=position,
+            speed=speed,
+            direction=direction,
+            dt=frame_length,
+            play_area=area,
+        )
+        samples.append(timer() - start)
+
+        if inc_score:
+            speed += opts.ball_speed_score_multiplier
+
+    return summarise(samples)
+
+
+def bench_trajectory(num_frames):
+    """
+    Time the same thing as `bench_handle_ball_physics`, but with the
+    closed-form `Trajectory` that the game actually uses
+    """
+    opts = options()
+    area = play_area(BENCH_DISPLAY_SIZE, opts)
+    frame_length = 1.0 / opts.target_fps
+
+    score = 0
+    path = trajectory.Trajectory(
+        position=(BENCH_DISPLAY_SIZE[0] // 2, BENCH_DISPLAY_SIZE[1] // 2),
+        direction=(1, 1),
+        speed=ball_speed(score, opts),
+        play_area=area,
+    )
+    samples = []
+
+    for frame in range(num_frames):
+        game_time = frame * frame_length
+
+        start = timer()
+        while path.bounce_time <= game_time:
+            score += 1
+            path = path.bounce(ball_speed(score, opts))
+
+        path.position_at(game_time)
+        samples.append(timer() - start)
+
+    return summarise(samples)
+
+
+def open_window(size):
+    """
+    Open a window in this process the same way `GameProcess.go` does
+
+    :return: A tuple of (surface, window handle)
+    """
+    # Imported here like in `GameProcess.go`, so that only this stage needs
+    # `pygame`
+    import pygame
+
+    pygame.display.init()
+    pygame.font.init()
+    surface = pygame.display.set_mode(size)
+
+    if windowing.is_headless():
+        handle = windowing.headless.create_window(size)
+    else:
+        handle = pygame.display.get_wm_info()['window']
+
+    return surface, handle
+
+
+def bench_render(num_frames):
+    """
+    Time drawing a whole frame, client-side, into a window the size of a
+    movable window positioned at the top left of the display (so the HUD and
+    most of the ball's path are on it)
+    """
+    opts = options()
+    surface, _ = open_window(opts.movable_window_size)
+    samples = []
+
+    for frame in range(num_frames):
+        renderables = frame_renderables(frame, opts)
+        cur_scene = dict(
+            (renderable.ident, renderable) for renderable in renderables
+        )
+
+        start = timer()
+        game.draw_scene(surface, cur_scene, (0, 0))
+        samples.append(timer() - start)
+
+    return summarise(samples)
+
+
+def bench_get_win_info(num_frames):
+    _, handle = open_window(options().movable_window_size)
+    samples = []
+
+    for _ in range(num_frames):
+        start = timer()
+        windowing.get_win_info(handle)
+        samples.append(timer() - start)
+
+    return summarise(samples)
+
+
+def bench_update_windows(num_frames, num_windows):
+    """
+    Time sending frames to and receiving state from `num_windows` movable
+    windows (plus the two paddle windows), each running in its own process
+
+    :return: A dictionary with the summary of every frame after the first,
+             plus the time the first (blocking) frame took
+    """
+    opts = options(
+        num_movable_windows=num_windows,
+        display_size=BENCH_DISPLAY_SIZE,
+    )
+    pool = mk_window_pool(BENCH_DISPLAY_SIZE, options=opts)
+
+    window_infos = list(repeat(None, len(pool.chans)))
+    window_scenes = list(repeat(None, len(pool.chans)))
+    samples = []
+    first_frame = None
+
+    try:
+        for frame in range(num_frames + 1):
+            renderables = frame_renderables(frame, opts)
+
+            start = timer()
+            msgs, window_scenes = update_windows(
+                windows=list(zip(pool.chans, window_infos, window_scenes)),
+                renderables=renderables,
+                ball_positions=[ball_position(frame)],
+                should_block=first_frame is None,
+            )
+            duration = timer() - start
+
+            if first_frame is None:
+                first_frame = duration
+            else:
+                samples.append(duration)
+
+            window_infos = [
+                get_client_state_or_default(msg, info)
+                for msg, info in zip(msgs, window_infos)
+            ]
+    finally:
+        close_window_pool(pool)
+
+        for proc in pool.procs:
+            proc.join()
+
+    out = summarise(samples)
+    out['first_frame_us'] = first_frame * 1e6
+    out['frame_budget_us'] = 1e6 / opts.target_fps
+
+    return out
+
+
+def run(stages, num_frames, window_counts):
+    """
+    Run some of the benchmarks
+
+    :param stages:        An enumerable of names from `STAGES`
+    :param num_frames:    The number of frames to time for each stage
+    :param window_counts: An enumerable of numbers of movable windows to time
+                          `update_windows` with
+    :return:              A JSON-serialisable dictionary of results
+    """
+    results = {}
+
+    for stage in stages:
+        if stage == 'mk_renderables':
+            results[stage] = bench_mk_renderables(num_frames)
+        elif stage == 'handle_ball_physics':
+            results[stage] = bench_handle_ball_physics(num_frames)
+        elif stage == 'trajectory':
+            results[stage] = bench_trajectory(num_frames)
+        elif stage == 'update_windows':
+            results[stage] = dict(
+                (
+                    str(num_windows),
+                    bench_update_windows(num_frames, num_windows),
+                )
+                for num_windows in window_counts
+            )
+        elif stage == 'render':
+            results[stage] = bench_render(num_frames)
+        elif stage == 'get_win_info':
+            results[stage] = bench_get_win_info(num_frames)
+        elif stage == 'wire':
+            results[stage] = bench_wire(num_frames)
+        else:
+            raise ValueError('Unknown stage {}'.format(stage))
+
+    return dict(
+        meta=dict(
+            frames=num_frames,
+            window_counts=list(window_counts),
+            headless=windowing.is_headless(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+        ),
+        results=results,
+    )
+
+
+if __name__ == '__main__':
+    usage = (
+        'Usage: python -m pong.bench [options]\n'
+        'Possible options:\n'
+        '    -f, --frames\n'
+        '        Frames to time per stage (default {})\n'
+        '    -w, --windows\n'
+        '        Comma-separated movable window counts (default {})\n'
+        '    -s, --stages\n'
+        '        Comma-separated stages to run, out of {} (default all)\n'
+        '    -o, --output\n'
+        '        Write the JSON results here instead of stdout\n'
+        '    -h, --help\n'
+        '        Show this message'
+    ).format(
+        DEFAULT_FRAMES,
+        ','.join(map(str, DEFAULT_WINDOW_COUNTS)),
+        ','.join(STAGES),
+    )
+
+    try:
+        opts, _ = getopt.getopt(
+            sys.argv[1:],
+            'f:w:s:o:h',
+            ['frames=', 'windows=', 'stages=', 'output=', 'help'],
+        )
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    num_frames = DEFAULT_FRAMES
+    window_counts = DEFAULT_WINDOW_COUNTS
+    stages = STAGES
+    output = None
+
+    for name, val in opts:
+        if name in ('-f', '--frames'):
+            num_frames = int(val)
+        elif name in ('-w', '--windows'):
+            window_counts = typed_tuple(int)(val)
+        elif name in ('-s', '--stages'):
+            stages = typed_tuple(str)(val)
+        elif name in ('-o', '--output'):
+            output = val
+        else:
+            print(usage)
+            sys.exit(0)
+
+    results = run(stages, num_frames, window_counts)
+
+    if output is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print('')
+    else:
+        with open(output, 'w') as out_file:
+            json.dump(results, out_file, indent=2, sort_keys=True)
@@ -0,0 +1,442 @@
+"""
+Process-aware, non-blocking channels built on top of shared memory.
+
+`multiprocessing.Pipe` blocks the sender as soon as the OS buffer fills up,
+which means that a single stalled window can freeze the whole game loop. The
+channels in this module are backed by fixed-capacity ring buffers instead, so
+sending never blocks: once a buffer is full the oldest unread entry is simply
+overwritten. Since every message this program sends supersedes the ones that
+came before it, losing stale messages is exactly what we want anyway.
+
+Alongside the messages, which are read in order, the parent can send each
+child "frames" through a single-slot buffer. Only the latest frame matters, so
+sending one replaces any the child hasn't got round to reading yet, and a slow
+child only ever falls behind by one frame instead of a whole buffer's worth.
+
+Shared memory can't be waited on with `select` and friends, so the parent's
+incoming buffer also has a "doorbell" pipe that holds a single byte whenever
+the buffer isn't empty. That lets `wait` sleep until any of a set of channels
+has something to read, however many there are.
+"""
+
+import ctypes
+import multiprocessing
+import pickle
+import select
+
+from multiprocessing import Pipe
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+try:
+    from multiprocessing.connection import wait as _wait_connections
+except ImportError:
+    # Python 2 doesn't have `wait`, but the pipes are plain file descriptors
+    # everywhere we run the game on Python 2, so `select` works just as well
+    def _wait_connections(connections, timeout=None):
+        ready, _, _ = select.select(connections, [], [], timeout)
+        return ready
+
+DEFAULT_CAPACITY = 8
+DEFAULT_SLOT_SIZE = 16 * 1024
+
+
+class RingBuffer(object):
+    """
+    A fixed-capacity ring buffer of byte strings living in shared memory.
+
+    NOTE: This is only safe with a single producer and a single consumer, which
+          is all we need since each buffer only carries one direction of a
+          single channel.
+    """
+
+    capacity = None
+    slot_size = None
+
+    def __init__(
+        self,
+        capacity=DEFAULT_CAPACITY,
+        slot_size=DEFAULT_SLOT_SIZE,
+        cond=None,
+        bell=False,
+    ):
+        """
+        :param capacity:  The number of entries the buffer holds
+        :param slot_size: The maximum size of an entry, in bytes
+        :param cond:      A `Condition` to lock the buffer with and notify on
+                          every push, or `None` for a new one. Buffers that
+                          share one can be waited on together
+        :param bell:      Whether to have a doorbell pipe, see `bell`. This
+                          costs two file descriptors
+        """
+        self.capacity = capacity
+        self.slot_size = slot_size
+
+        self._data = RawArray(ctypes.c_char, capacity * slot_size)
+        self._lengths = RawArray(ctypes.c_uint32, capacity)
+
+        # These only ever increase, the slot index is the counter modulo
+        # `capacity`. Using 64-bit counters means that we never have to worry
+        # about them wrapping.
+        self._written = RawValue(ctypes.c_uint64, 0)
+        self._read = RawValue(ctypes.c_uint64, 0)
+        self._dropped = RawValue(ctypes.c_uint64, 0)
+
+        self._cond = cond if cond is not None else multiprocessing.Condition()
+
+        # Holds exactly one byte while the buffer isn't empty. Both ends are
+        # only touched with `_cond` held, so the byte can't go missing between
+        # a push and a pop.
+        if bell:
+            self._bell_reader, self._bell_writer = Pipe(duplex=False)
+        else:
+            self._bell_reader = self._bell_writer = None
+
+    def bell(self):
+        """
+        :return: A `Connection` that's readable whenever the buffer isn't
+                 empty, or `None` if the buffer doesn't have a doorbell. Only
+                 wait on it, don't read from it
+        """
+        return self._bell_reader
+
+    def pending(self):
+        """
+        The number of entries that have been pushed but not yet popped. This
+        doesn't take the lock, since a single aligned read is all we need.
+
+        :return: An integer between 0 and `capacity`
+        """
+        return self._written.value - self._read.value
+
+    def full(self):
+        """
+        Whether the next `push` would overwrite an unread entry. Since there is
+        only one producer, a `False` return value will stay correct until the
+        caller next pushes.
+        """
+        return self.pending() >= self.capacity
+
+    def dropped(self):
+        """
+        :return: The total number of entries overwritten before being read
+        """
+        return self._dropped.value
+
+    def wait(self, ready=None, timeout=None):
+        """
+        Block until there's something to pop, or a push to another buffer
+        sharing this one's `Condition` makes `ready` true
+
+        :param ready:   A function saying whether to stop waiting, which is
+                        called with the lock held, or `None` to wait for this
+                        buffer to have an entry
+        :param timeout: The longest to wait for, in seconds, or `None` to wait
+                        forever
+        :return:        What `ready` returned when the wait ended
+        """
+        if ready is None:
+            def ready():
+                return self.pending() > 0
+
+        with self._cond:
+            if not ready():
+                self._cond.wait(timeout)
+
+            return ready()
+
+    def push(self, data):
+        """
+        Write an entry to the buffer, overwriting the oldest unread entry if
+        the buffer is full. This never blocks for longer than it takes the
+        consumer to copy a single entry out.
+
+        :param data: A byte string no longer than `slot_size`
+        """
+        length = len(data)
+
+        if length > self.slot_size:
+            raise ValueError(
+                'Message of {} bytes does not fit in a {} byte slot'.format(
+                    length,
+                    self.slot_size,
+                )
+            )
+
+        with self._cond:
+            was_empty = self.pending() == 0
+
+            index = self._written.value % self.capacity
+            start = index * self.slot_size
+
+            self._data[start:start + length] = data
+            self._lengths[index] = length
+            self._written.value += 1
+
+            overflow = self.pending() - self.capacity
+            if overflow > 0:
+                self._read.value += overflow
+                self._dropped.value += overflow
+
+            if was_empty and self._bell_writer is not None:
+                self._bell_writer.send_bytes(b'\0')
+
+            self._cond.notify_all()
+
+    def pop(self, block=True, latest=False):
+        """
+        Read an entry from the buffer.
+
+        :param block:  If `False`, return `None` instead of waiting when the
+                       buffer is empty
+        :param latest: If `True`, skip straight to the most recently-pushed
+                       entry, discarding everything before it
+        :return:       A byte string, or `None`
+        """
+        with self._cond:
+            while self.pending() == 0:
+                if not block:
+                    return None
+
+                self._cond.wait()
+
+            if latest:
+                self._read.value = self._written.value - 1
+
+            index = self._read.value % self.capacity
+            start = index * self.slot_size
+            out = self._data[start:start + self._lengths[index]]
+
+            self._read.value += 1
+
+            if self.pending() == 0 and self._bell_reader is not None:
+                self._bell_reader.recv_bytes()
+
+        return out
+
+
+class Channel(object):
+    """
+    One endpoint of a duplex channel. This mirrors the parts of
+    `multiprocessing.Connection` that the rest of the program uses, so it can
+    be dropped in wherever a `Pipe` endpoint was used before.
+
+    Objects are turned into bytes with `encode` and back with `decode`, which
+    default to pickling. These must be module-level functions, since the
+    channel itself gets pickled when it's handed to a child process.
+
+    `incoming_frames` and `outgoing_frames` are the single-slot buffers for
+    frames, if this end receives or sends them. Frames are sent with
+    `send_frame` and read with `recv_frame`.
+    """
+
+    def __init__(
+        self,
+        incoming,
+        outgoing,
+        encode=None,
+        decode=None,
+        incoming_frames=None,
+        outgoing_frames=None,
+    ):
+        self._incoming = incoming
+        self._outgoing = outgoing
+        self._incoming_frames = incoming_frames
+        self._outgoing_frames = outgoing_frames
+        self._encode = encode if encode is not None else _pickle_dumps
+        self._decode = decode if decode is not None else pickle.loads
+
+    def send(self, obj):
+        self._outgoing.push(self._encode(obj))
+
+    def recv(self):
+        return self._decode(self._incoming.pop())
+
+    def recv_latest(self):
+        """
+        Block until there is at least one message available, then return the
+        most recent one and discard the rest. Unlike repeatedly calling `recv`
+        this only decodes a single message.
+        """
+        return self._decode(self._incoming.pop(latest=True))
+
+    def poll(self):
+        return self._incoming.pending() > 0
+
+    def send_frame(self, obj):
+        """
+        Send a frame, replacing the last one if it hasn't been read yet
+        """
+        self._outgoing_frames.push(self._encode(obj))
+
+    def recv_frame(self):
+        """
+        :return: The latest frame, or `None` if there's no new frame since the
+                 last call
+        """
+        data = self._incoming_frames.pop(block=False)
+
+        return None if data is None else self._decode(data)
+
+    def frame_pending(self):
+        """
+        Whether the last frame sent from this end hasn't been read yet. Once
+        this is `False` it stays that way until the next `send_frame`.
+        """
+        return self._outgoing_frames.pending() > 0
+
+    def frames_dropped(self):
+        """
+        :return: The number of frames sent from this end that were replaced
+                 before the other end read them
+        """
+        return self._outgoing_frames.dropped()
+
+    def wait(self, timeout=None):
+        """
+        Block until there's a message or a frame to receive. The two incoming
+        buffers share a `Condition`, so this doesn't need a doorbell.
+
+        :param timeout: The longest to wait for, in seconds, or `None` to wait
+                        forever
+        :return:        Whether there's anything to receive
+        """
+        def ready():
+            return self._incoming.pending() > 0 or (
+                self._incoming_frames is not None and
+                self._incoming_frames.pending() > 0
+            )
+
+        return self._incoming.wait(ready, timeout)
+
+    def bell(self):
+        """
+        :return: A `Connection` that's readable whenever there's a message
+                 to `recv`, see `wait`
+        """
+        return self._incoming.bell()
+
+    def full(self):
+        """
+        Whether the next `send` would overwrite a message the other end hasn't
+        read yet
+        """
+        return self._outgoing.full()
+
+    def dropped(self):
+        """
+        :return: The number of messages sent from this end that were
+                 overwritten before the other end read them
+        """
+        return self._outgoing.dropped()
+
+
+def wait(channels, timeout=None):
+    """
+    Sleep until at least one of some channels has a message to read, like
+    `multiprocessing.connection.wait`
+
+    Anything with the same methods as a `Channel` can be waited on too. Some
+    of those share one doorbell between many of them (e.g. the windows in
+    `pong.xrender`, which all talk to the same X connection), so a doorbell
+    ringing only means that one of them _might_ have a message, and `poll` is
+    asked which.
+
+    :param channels: An enumerable of `Channel`s
+    :param timeout:  The longest to wait for, in seconds, or `None` to wait
+                     forever
+    :return:         A list of the channels with messages, which is empty if
+                     the timeout ran out first
+    """
+    by_bell = {}
+
+    for chan in channels:
+        by_bell.setdefault(chan.bell(), []).append(chan)
+
+    if None in by_bell:
+        raise ValueError('Only channels with a doorbell can be waited on')
+
+    if not by_bell:
+        return []
+
+    # A shared doorbell can have been answered already, without any of the
+    # messages behind it having been read yet
+    shared = [
+        chan
+        for bell_chans in by_bell.values()
+        if len(bell_chans) > 1
+        for chan in bell_chans
+    ]
+    ready = [chan for chan in shared if chan.poll()]
+
+    if ready:
+        return ready
+
+    return [
+        chan
+        for bell in _wait_connections(list(by_bell), timeout)
+        for chan in by_bell[bell]
+        if len(by_bell[bell]) == 1 or chan.poll()
+    ]
+
+
+def _pickle_dumps(obj):
+    return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+
+def pipe(
+    capacity=DEFAULT_CAPACITY,
+    slot_size=DEFAULT_SLOT_SIZE,
+    encode=None,
+    decode=None,
+    context=multiprocessing,
+):
+    """
+    Create a pair of connected `Channel`s, analogous to `multiprocessing.Pipe`
+
+    :param capacity:  The number of messages that can be buffered in each
+                      direction before the oldest starts being overwritten
+    :param slot_size: The maximum size of a single encoded message, in bytes
+    :param encode:    A function turning a message into bytes, or `None` to
+                      use `pickle`
+    :param decode:    The inverse of `encode`
+    :param context:   The `multiprocessing` context that the process using
+                      the other end is started with. Locks made for one
+                      start method can't always be passed to a process
+                      started with another
+    :return:          A tuple of two `Channel`s. Only the first can send
+                      frames, and only the first can be passed to `wait`
+    """
+    a_to_b_cond = context.Condition()
+    a_to_b = RingBuffer(
+        capacity=capacity,
+        slot_size=slot_size,
+        cond=a_to_b_cond,
+    )
+    a_to_b_frames = RingBuffer(
+        capacity=1,
+        slot_size=slot_size,
+        cond=a_to_b_cond,
+    )
+    b_to_a = RingBuffer(
+        capacity=capacity,
+        slot_size=slot_size,
+        cond=context.Condition(),
+        bell=True,
+    )
+
+    return (
+        Channel(
+            b_to_a,
+            a_to_b,
+            encode=encode,
+            decode=decode,
+            outgoing_frames=a_to_b_frames,
+        ),
+        Channel(
+            a_to_b,
+            b_to_a,
+            encode=encode,
+            decode=decode,
+            incoming_frames=a_to_b_frames,
+        ),
+    )
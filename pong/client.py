@@ -0,0 +1,77 @@
+"""
+Runs a game window that connects to a game on another machine (or the same
+one), see `pong.net`. Start the game with `python -m pong -x net`, then run
+`python -m pong.client <host>:<port>` once for each window it's waiting for.
+Use `--help` for the options.
+
+`--loss` and `--latency` make the frames the window is sent go missing or
+arrive late, to try out a bad network on one machine, and `--skew` moves the
+window's clock away from the game's, like another machine's would be.
+"""
+
+import getopt
+import sys
+
+from . import clock, game, net
+
+if __name__ == '__main__':
+    usage = (
+        'Usage: python -m pong.client [options] <host>:<port>\n'
+        'Possible options:\n'
+        '    -l, --loss\n'
+        '        Lose this fraction of the frames sent to the window, from 0 '
+        'to 1\n'
+        '    -d, --latency\n'
+        '        Delay the frames sent to the window by this many seconds\n'
+        '    -s, --skew\n'
+        '        Run the window\'s clock this many seconds ahead of this '
+        'machine\'s\n'
+        '    -h, --help\n'
+        '        Show this message'
+    )
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:],
+            'l:d:s:h',
+            ['loss=', 'latency=', 'skew=', 'help'],
+        )
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    loss = 0.0
+    latency = 0.0
+    skew = 0.0
+
+    for name, val in opts:
+        if name in ('-l', '--loss'):
+            loss = float(val)
+        elif name in ('-d', '--latency'):
+            latency = float(val)
+        elif name in ('-s', '--skew'):
+            skew = float(val)
+        else:
+            print(usage)
+            sys.exit(0)
+
+    if len(args) != 1:
+        print(usage)
+        sys.exit(2)
+
+    if skew:
+        machine_clock = clock.monotonic
+
+        def skewed_clock():
+            return machine_clock() + skew
+
+        # Everything in the window that tells the time goes through this
+        clock.monotonic = skewed_clock
+
+    if loss or latency:
+        impairment = net.Impairment(loss=loss, latency=latency)
+    else:
+        impairment = None
+
+    spec, conn = net.connect(args[0], impairment=impairment)
+    game.run_process(game.GameProcess(**spec), conn)
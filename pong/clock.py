@@ -0,0 +1,148 @@
+"""
+Frame pacing. `FrameScheduler` hands out frame deadlines on a monotonic clock
+and waits for them precisely, by sleeping for most of the time left and then
+spinning for the last fraction of a millisecond (sleeping is only accurate to
+within a timer tick or so, which is a big chunk of a frame at 240Hz).
+
+Deadlines are absolute, each one a fixed `frame_length` after the last, so
+the frame rate doesn't drift however late each individual wakeup is.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import time
+
+from . import instrument
+
+DEFAULT_SPIN_TIME = 0.0005
+
+
+def _fallback_monotonic():
+    """
+    Python 2 doesn't have `time.monotonic`, so ask the OS directly where we
+    can, and otherwise settle for the best clock the `time` module has
+    """
+    if os.name == 'nt':
+        # This is the performance counter on Windows, which is monotonic
+        return time.clock
+
+    class Timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        librt = ctypes.CDLL(
+            ctypes.util.find_library('rt') or ctypes.util.find_library('c'),
+            use_errno=True,
+        )
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+
+    clock_monotonic = 1
+    timespec = Timespec()
+
+    def monotonic():
+        if clock_gettime(clock_monotonic, ctypes.byref(timespec)) != 0:
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+    return monotonic
+
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    monotonic = _fallback_monotonic()
+
+
+class FrameScheduler(object):
+    """
+    Paces a loop to a fixed frame rate.
+
+    Call `start_frame` at the top of every frame and `wait` at the bottom.
+    `start_frame` records how late the frame started (the jitter) and how
+    long it's been since the last one in `stats`, as 'lateness' and
+    'interval'. If a frame overruns so badly that the next deadline has
+    already passed, the missed deadlines are skipped rather than run back to
+    back to catch up, and counted in `missed` (and in `stats`).
+    """
+
+    frame_length = None
+    spin_time = None
+    deadline = None
+    missed = None
+
+    def __init__(
+        self,
+        frame_length,
+        clock=None,
+        sleep=time.sleep,
+        spin_time=DEFAULT_SPIN_TIME,
+        stats=instrument.NullFrameStats(),
+    ):
+        """
+        :param frame_length: The length of a frame, in seconds
+        :param clock:        A function returning the current time in seconds,
+                             which must never go backwards, or `None` for
+                             `monotonic`
+        :param sleep:        A function sleeping for some number of seconds
+        :param spin_time:    How long before the deadline to stop sleeping and
+                             start spinning, in seconds
+        :param stats:        A `FrameStats` to record jitter in
+        """
+        self.frame_length = frame_length
+        self.clock = monotonic if clock is None else clock
+        self.spin_time = spin_time
+        self.missed = 0
+
+        self._sleep = sleep
+        self._stats = stats
+        self._last_start = None
+
+        self.deadline = self.clock()
+
+    def start_frame(self):
+        """
+        Mark the start of a frame and move the deadline on to the next one
+
+        :return: The current time, according to `clock`
+        """
+        now = self.clock()
+
+        self._stats.record('lateness', max(now - self.deadline, 0))
+
+        if self._last_start is not None:
+            self._stats.record('interval', now - self._last_start)
+
+        self._last_start = now
+        self.deadline += self.frame_length
+
+        if self.deadline <= now:
+            skipped = int((now - self.deadline) // self.frame_length) + 1
+            self.missed += skipped
+            self._stats.miss(skipped)
+            self.deadline += skipped * self.frame_length
+
+        return now
+
+    def remaining(self):
+        """
+        :return: The number of seconds until the next deadline, which is
+                 negative if it has passed
+        """
+        return self.deadline - self.clock()
+
+    def wait(self):
+        """
+        Block until the next deadline. This sleeps until `spin_time` before
+        it, then spins.
+        """
+        remaining = self.remaining()
+
+        if remaining > self.spin_time:
+            self._sleep(remaining - self.spin_time)
+
+        while self.clock() < self.deadline:
+            pass
@@ -1,17 +1,96 @@
-from . import windowing, messages
+from . import windowing, messages, scene, clock, trajectory
 from .render import BLACK
 
-import pygame
 import sys
 import os
 import time
 
+from itertools import chain
+
+
+# How far along the last two frames a window will draw, where 0 is the older
+# one and 1 the newer. Anything over 1 extrapolates past the newer frame when
+# the next one is late.
+MAX_ALPHA = 2
+
 
 def shutdown():
+    import pygame
+
     pygame.quit()
     sys.exit()
 
 
+def draw_scene(surface, cur_scene, offset):
+    """
+    Clear a surface and draw a whole scene onto it
+
+    :param surface:   The `pygame.Surface` to draw to
+    :param cur_scene: A scene dictionary (see `pong.scene`)
+    :param offset:    A two-element tuple of the surface's position on screen
+    :return:          A dictionary of ident to the rect each renderable drew to
+    """
+    surface.fill(BLACK)
+
+    return dict(
+        (ident, renderable.render(surface, offset))
+        for ident, renderable in cur_scene.items()
+    )
+
+
+def draw_damage(surface, cur_scene, offset, drawn_rects, dirty_idents):
+    """
+    Redraw only the parts of a surface affected by some renderables changing,
+    assuming the surface's offset hasn't changed since the last draw. The
+    areas the dirty renderables covered last frame are erased, then the dirty
+    renderables and anything else overlapping the erased areas are redrawn.
+
+    :param surface:      The `pygame.Surface` to draw to
+    :param cur_scene:    A scene dictionary (see `pong.scene`)
+    :param offset:       A two-element tuple of the surface's position on
+                         screen
+    :param drawn_rects:  The rects returned by the last call to this or
+                         `draw_scene`
+    :param dirty_idents: A set of the idents that were changed or removed since
+                         the last draw
+    :return:             A tuple of (dictionary of ident to the rect each
+                         renderable drew to, list of rects to pass to
+                         `pygame.display.update`)
+    """
+    erased = [
+        drawn_rects[ident]
+        for ident in dirty_idents
+        if drawn_rects.get(ident) is not None
+    ]
+
+    for rect in erased:
+        surface.fill(BLACK, rect)
+
+    out_rects = dict(
+        (ident, rect)
+        for ident, rect in drawn_rects.items()
+        if ident in cur_scene and ident not in dirty_idents
+    )
+
+    to_draw = [
+        ident
+        for ident in cur_scene
+        if ident in dirty_idents or (
+            out_rects.get(ident) is not None and
+            out_rects[ident].collidelist(erased) != -1
+        )
+    ]
+
+    for ident in to_draw:
+        out_rects[ident] = cur_scene[ident].render(surface, offset)
+
+    return out_rects, erased + [
+        out_rects[ident]
+        for ident in to_draw
+        if out_rects[ident] is not None
+    ]
+
+
 class GameProcess(object):
     """
     A single instance of the game's client processes
@@ -26,42 +105,104 @@ class GameProcess(object):
     size=None
     centered=None
     pinned=None
+    present_fps=None
 
     def __init__(
         self,
         position=None,
         size=(300, 300),
         centered=False,
-        pinned=False
+        pinned=False,
+        present_fps=None,
     ):
+        """
+        :param present_fps: How many times a second to draw, interpolating
+                            between the frames the parent sends. If `None`,
+                            each frame is drawn as soon as it arrives
+        """
         self.position = position
         self.size = size
         self.centered = centered
         self.pinned = pinned
+        self.present_fps = present_fps
 
     def go(self, conn):
+        # Imported here so that the parent process, which only needs this
+        # class to start the windows with, doesn't import `pygame`
+        import pygame
+
         if self.centered:
             os.environ['SDL_VIDEO_CENTERED'] = '1'
 
-        pygame.init()
+        # Only start the parts of SDL we use, `pygame.init` would start the
+        # audio and joysticks too
+        pygame.display.init()
+        pygame.font.init()
         surface = pygame.display.set_mode(self.size)
-        win_handle = pygame.display.get_wm_info()['window']
+
+        if windowing.is_headless():
+            win_handle = windowing.headless.create_window(
+                self.size,
+                self.position,
+            )
+        else:
+            win_handle = pygame.display.get_wm_info()['window']
 
         if self.position is not None:
             windowing.set_translation(win_handle, self.position)
 
-        win_info = windowing.get_win_info(win_handle)
-
         if self.pinned:
-            pin = win_info.x, win_info.y
+            windowing.pin_window(win_handle, self.position, fixed=True)
+
+        # Tell the parent the window is ready, see `wait_for_windows`
+        conn.send(messages.client_state(windowing.get_win_info(win_handle)))
+
+        # The logical position of a frozen window, see below. Windows that are
+        # pinned for their whole lifetime can't be dragged around, so they
+        # just report their actual position.
+        pin = None
+
+        if self.present_fps is None:
+            scheduler = None
         else:
-            pin = None
+            scheduler = clock.FrameScheduler(1.0 / self.present_fps)
+
+        # The latest scene we've been sent, and the one before it along with
+        # the times they're snapshots of. When we draw on our own schedule,
+        # we draw somewhere between the two.
+        cur_scene = {}
+        cur_time = None
+        prev_scene = None
+        prev_time = None
+
+        # Where the ball is going, if the parent is leaving it to us to move
+        # the ball (see `messages.predict`)
+        prediction = None
+        path = None
+
+        shown_scene = {}
+        drawn_offset = None
+        drawn_rects = {}
 
         while True:
-            win_handle = pygame.display.get_wm_info()['window']
+            # The parent sends lists of messages. Control messages (resets
+            # and quits) have to be handled in order, but only the latest
+            # frame matters. The parent sends a frame every tick, so this
+            # only waits for long if it's busy.
+            if scheduler is None:
+                conn.wait()
+            else:
+                scheduler.start_frame()
+
             win_info = windowing.get_win_info(win_handle)
 
-            in_msgs = messages.consume_connection_buffer(conn)
+            in_msgs = chain(
+                chain.from_iterable(
+                    messages.drain_connection_buffer(conn, block=False)
+                ),
+                conn.recv_frame() or (),
+            )
+            full_redraw = False
 
             for in_msg in in_msgs:
                 # TODO: Using the same "quit" signaller for clients and
@@ -70,47 +211,123 @@ class GameProcess(object):
                 #       namedtuples
                 if messages.is_quit(in_msg):
                     shutdown()
+                elif messages.is_timestamp(in_msg):
+                    # This comes before the frame's `render`, if it has one
+                    prev_scene, prev_time = cur_scene, cur_time
+                    cur_time = in_msg.info
                 elif messages.is_render(in_msg):
-                    # TODO: On the parent, only send renderables that would be
-                    #       rendered on the child and then diff it with the
-                    #       last frame's renderables, so most frames won't call
-                    #       update. Currently not necessary because we've got
-                    #       plenty FPS to spare.
-
-                    surface.fill(BLACK)
-
-                    for renderable in in_msg.info:
-                        # Explicitly use the actual position, not the logical
-                        # position (see below for an explanation of the
-                        # difference). With my current WM setup this doesn't
-                        # help much, but if you had a window manager that
-                        # ignored/buffered messages to set position while the
-                        # window is being dragged it would improve the visuals
-                        # a fair amount.
-                        renderable.render(surface, (win_info.x, win_info.y))
-
-                    # TODO: Return bounding boxes out of `render`, convert
-                    #       for to map, pass it to this. Again, not necessary
-                    #       because we don't need the performance.
-                    pygame.display.update()
+                    cur_scene = scene.apply(cur_scene, in_msg.info)
+                elif messages.is_predict(in_msg):
+                    prediction = in_msg.info
+                    path = trajectory.Trajectory(
+                        position=prediction.position,
+                        direction=prediction.direction,
+                        speed=prediction.speed,
+                        play_area=prediction.play_area,
+                        start=prediction.start,
+                    )
+                elif messages.is_reset(in_msg):
+                    if in_msg.info is not None:
+                        windowing.set_translation(win_handle, in_msg.info)
+
+                        if self.pinned:
+                            windowing.pin_window(win_handle, in_msg.info)
+
+                    if not self.pinned:
+                        pin = None
+                        windowing.unpin_window(win_handle)
+
+                    cur_scene = {}
+                    cur_time = prev_scene = prev_time = None
+                    prediction = path = None
+                    full_redraw = True
                 elif messages.is_freeze(in_msg):
                     if not pin and not self.pinned:
                         pin = win_info.x, win_info.y
+                        windowing.pin_window(win_handle)
                 elif messages.is_unfreeze(in_msg):
                     if not self.pinned:
                         pin = None
+                        windowing.unpin_window(win_handle)
                 else:
                     print('Cannot interpret {}'.format(in_msg))
                     raise NotImplementedError()
 
+            new_shown = cur_scene
+
+            # Draw one broadcast behind the parent, so that there's usually a
+            # frame on either side to interpolate between. If the next frame
+            # is late we carry on in the same direction for a while.
+            if (
+                scheduler is not None and
+                prev_time is not None and
+                cur_time > prev_time
+            ):
+                alpha = (scheduler.clock() - cur_time) / (cur_time - prev_time)
+                new_shown = scene.interpolate(
+                    prev_scene,
+                    cur_scene,
+                    min(max(alpha, 0), MAX_ALPHA),
+                )
+
+            if scheduler is not None and prediction is not None:
+                new_shown = scene.follow(
+                    new_shown,
+                    prediction.ball,
+                    prediction.followers,
+                    path.position_at(scheduler.clock()),
+                )
+
+            # Work out what changed ourselves instead of going by the deltas,
+            # since the whole scene is sent if we fell behind but usually most
+            # of it is the same as what we drew
+            changes = scene.diff(shown_scene, new_shown)
+            shown_scene = new_shown
+            dirty_idents = set()
+
+            if changes is not None:
+                dirty_idents.update(
+                    renderable.ident for renderable in changes.info.changed
+                )
+                dirty_idents.update(changes.info.removed)
+
+            # Explicitly use the actual position, not the logical position (see
+            # below for an explanation of the difference). With my current WM
+            # setup this doesn't help much, but if you had a window manager
+            # that ignored/buffered messages to set position while the window
+            # is being dragged it would improve the visuals a fair amount.
+            offset = win_info.x, win_info.y
+
+            # Nothing we draw depends on anything but the scene and where the
+            # window is, so if neither changed (and the window manager didn't
+            # throw away our pixels) then last frame is still good. If only
+            # some renderables changed, only the area under them is redrawn.
+            exposed = any(pygame.event.get(pygame.VIDEOEXPOSE))
+
+            if full_redraw or exposed or offset != drawn_offset:
+                drawn_rects = draw_scene(surface, shown_scene, offset)
+                pygame.display.update()
+                drawn_offset = offset
+            elif dirty_idents:
+                drawn_rects, update_rects = draw_damage(
+                    surface,
+                    shown_scene,
+                    offset,
+                    drawn_rects,
+                    dirty_idents,
+                )
+                pygame.display.update(update_rects)
+
+            # Only moves the window if it's pinned and we've been told that it
+            # has drifted away from its pin
+            windowing.enforce_pin(win_handle)
+
             # Pretend that we're still at the pin position if we're supposed to
             # be pinned (i.e. make `winf` track the _logical_ position of the
             # window, ignoring the _actual_ position, which can fluctuate)
             if pin is None:
                 winf = win_info
             else:
-                windowing.set_translation(win_handle, pin)
-
                 winf = windowing.WindowInfo(
                     x=pin[0],
                     y=pin[1],
@@ -124,6 +341,9 @@ class GameProcess(object):
             else:
                 conn.send(messages.client_state(winf))
 
+            if scheduler is not None:
+                scheduler.wait()
+
 
 def run_process(game_process, connection):
     """
@@ -131,6 +351,6 @@ def run_process(game_process, connection):
     will never return.
 
     :param game_process: An instance of `GameProcess`
-    :param connection:   An endpoint of a `Pipe`
+    :param connection:   An endpoint of a `pong.channel.pipe`
     """
     game_process.go(connection)
@@ -0,0 +1,325 @@
+"""
+Cheap per-stage timing for the game loop. Timings go into fixed-size
+histograms, so recording a sample is O(1) and memory use doesn't grow however
+long the game runs.
+"""
+
+import math
+import sys
+import time
+
+from collections import OrderedDict
+
+# Buckets are spaced logarithmically, `BUCKETS_PER_OCTAVE` per doubling,
+# starting at `MIN_BUCKET` seconds. 1344 buckets at 64 per octave covers 1us
+# to about two seconds, each bucket about 1% wider than the last, and anything
+# longer goes in the last bucket. That's fine enough to tell a frame at 240Hz
+# from one a tenth of a millisecond late.
+MIN_BUCKET = 1e-6
+BUCKETS_PER_OCTAVE = 64
+NUM_BUCKETS = 1344
+
+
+def bucket_upper_bound(index):
+    """
+    :param index: A bucket index
+    :return:      The largest duration, in seconds, that goes in that bucket
+    """
+    return MIN_BUCKET * 2 ** (float(index) / BUCKETS_PER_OCTAVE)
+
+
+class Histogram(object):
+    """
+    A fixed-size histogram of durations
+    """
+
+    count = None
+    total = None
+    min = None
+    max = None
+
+    def __init__(self):
+        self.counts = [0] * (NUM_BUCKETS + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds <= MIN_BUCKET:
+            index = 0
+        else:
+            index = min(
+                int(
+                    math.ceil(
+                        math.log(seconds / MIN_BUCKET, 2) * BUCKETS_PER_OCTAVE
+                    )
+                ),
+                NUM_BUCKETS,
+            )
+
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """
+        Estimate a percentile from the buckets, assuming the durations in
+        the bucket it falls in are spread evenly across it. This is accurate
+        to within one bucket, i.e. about 1%, and usually much better.
+
+        :param p: The percentile, between 0 and 100
+        :return:  A duration in seconds
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = max(int(math.ceil(p / 100.0 * self.count)), 1)
+        seen = 0
+
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank:
+                lower = 0.0 if index == 0 else bucket_upper_bound(index - 1)
+                upper = bucket_upper_bound(index)
+                estimate = lower + (upper - lower) * (
+                    float(rank - seen) / bucket_count
+                )
+
+                return min(max(estimate, self.min), self.max)
+
+            seen += bucket_count
+
+        return self.max
+
+    def summary(self):
+        """
+        :return: A dictionary of statistics, in milliseconds
+        """
+        return OrderedDict(
+            (
+                ('count', self.count),
+                ('mean_ms', self.total * 1e3 / max(self.count, 1)),
+                ('p50_ms', self.percentile(50) * 1e3),
+                ('p99_ms', self.percentile(99) * 1e3),
+                ('max_ms', self.max * 1e3),
+            )
+        )
+
+
+class FrameStats(object):
+    """
+    Times each stage of every frame of the game loop.
+
+    Call `start_frame` at the top of the loop and `lap` after each stage, which
+    records the time since the previous `lap` (or `start_frame`). Things that
+    happen many times in a frame (like sending to each window) can be timed
+    with `record` directly.
+    """
+
+    frame_length = None
+    report_interval = None
+    frames = None
+    overruns = None
+    missed = None
+
+    def __init__(
+        self,
+        frame_length,
+        report_interval=0,
+        clock=time.time,
+        counters=None,
+    ):
+        """
+        :param frame_length:    The target length of a frame, in seconds.
+                                Frames that take longer than this are counted
+                                as overruns
+        :param report_interval: How often `maybe_report` prints a summary, in
+                                seconds. If 0 it never does
+        :param clock:           A function returning the current time in
+                                seconds
+        :param counters:        A function returning a dictionary of name to
+                                count, to add to each summary, or `None`
+        """
+        self.frame_length = frame_length
+        self.report_interval = report_interval
+        self.frames = 0
+        self.overruns = 0
+        self.missed = 0
+
+        self.histograms = OrderedDict()
+        self._clock = clock
+        self._counters = counters
+        self._last = clock()
+        self._last_report = self._last
+
+    def record(self, stage, seconds):
+        if stage not in self.histograms:
+            self.histograms[stage] = Histogram()
+
+        self.histograms[stage].record(seconds)
+
+    def start_frame(self):
+        self._last = self._clock()
+
+    def mark(self):
+        """
+        Start timing the next stage without recording the last one, for when
+        a stage timed its own parts with `record`
+        """
+        self._last = self._clock()
+
+    def lap(self, stage):
+        now = self._clock()
+        self.record(stage, now - self._last)
+        self._last = now
+
+    def end_frame(self, busy_time):
+        """
+        :param busy_time: How long the frame took, not counting time spent
+                          waiting for the next one
+        """
+        self.frames += 1
+        self.record('frame', busy_time)
+
+        if busy_time > self.frame_length:
+            self.overruns += 1
+
+    def miss(self, deadlines):
+        """
+        :param deadlines: How many frame deadlines passed without a frame
+                          starting (see `pong.clock.FrameScheduler`)
+        """
+        self.missed += deadlines
+
+    def format_summary(self):
+        """
+        :return: A human-readable table of every stage's timings
+        """
+        lines = [
+            'frames: {}, overran {:.1f}ms budget: {} ({:.1f}%), '
+            'missed deadlines: {}'.format(
+                self.frames,
+                self.frame_length * 1e3,
+                self.overruns,
+                100.0 * self.overruns / max(self.frames, 1),
+                self.missed,
+            ),
+            '{:<16}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+                'stage', 'count', 'mean ms', 'p50 ms', 'p99 ms', 'max ms',
+            ),
+        ]
+
+        for stage, histogram in self.histograms.items():
+            lines.append(
+                '{:<16}{:>10}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}'.format(
+                    stage,
+                    *histogram.summary().values()
+                )
+            )
+
+        if self._counters is not None:
+            for name, count in self._counters().items():
+                lines.append('{}: {}'.format(name, count))
+
+        return '\n'.join(lines)
+
+    def report(self, out=sys.stderr):
+        out.write(self.format_summary() + '\n')
+        out.flush()
+
+    def maybe_report(self, out=sys.stderr):
+        """
+        Print a summary if it's been at least `report_interval` seconds since
+        the last one
+        """
+        if not self.report_interval:
+            return
+
+        now = self._clock()
+
+        if now - self._last_report >= self.report_interval:
+            self.report(out)
+            self._last_report = now
+
+
+class StartupTimes(object):
+    """
+    Times how long the game takes to get to each of a few milestones after
+    starting up (e.g. the first frame), which unlike frame times only happen
+    once, so there's nothing to build a histogram of.
+
+    :param start: When the game started, according to `clock`
+    :param clock: A function returning the current time in seconds
+    """
+
+    start = None
+
+    def __init__(self, start, clock=time.time):
+        self.start = start
+        self.milestones = OrderedDict()
+
+        self._clock = clock
+
+    def mark(self, milestone):
+        """
+        Record that a milestone was reached now. Only the first time each
+        milestone is reached counts.
+        """
+        if milestone not in self.milestones:
+            self.milestones[milestone] = self._clock() - self.start
+
+    def format_summary(self):
+        """
+        :return: A human-readable table of the time to reach each milestone,
+                 and the time since the one before
+        """
+        lines = ['{:<16}{:>10}{:>10}'.format('startup', 'at ms', 'took ms')]
+        last = 0.0
+
+        for milestone, seconds in self.milestones.items():
+            lines.append(
+                '{:<16}{:>10.1f}{:>10.1f}'.format(
+                    milestone,
+                    seconds * 1e3,
+                    (seconds - last) * 1e3,
+                )
+            )
+            last = seconds
+
+        return '\n'.join(lines)
+
+    def report(self, out=sys.stderr):
+        out.write(self.format_summary() + '\n')
+        out.flush()
+
+
+class NullFrameStats(object):
+    """
+    A `FrameStats` that does nothing, for when instrumentation is turned off
+    """
+
+    def record(self, stage, seconds):
+        pass
+
+    def start_frame(self):
+        pass
+
+    def mark(self):
+        pass
+
+    def lap(self, stage):
+        pass
+
+    def end_frame(self, busy_time):
+        pass
+
+    def miss(self, deadlines):
+        pass
+
+    def report(self, out=sys.stderr):
+        pass
+
+    def maybe_report(self, out=sys.stderr):
+        pass
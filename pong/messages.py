@@ -10,14 +10,51 @@ from collections import namedtuple
 
 Message = namedtuple('Message', ('type', 'info'))
 
-# TODO: String idents are just for debugging, maybe convert these to
-#       `gen_ident` function that returns an opaque integer (can't use opaque
-#       object, see note)
-QUIT = 'quit'
-RENDER = 'render'
-FREEZE = 'freeze'
-UNFREEZE = 'unfreeze'
-CLIENT_STATE = 'client_state'
+# The info for a `render` message. `changed` is a list of `Renderable`s that
+# were added or modified, and `removed` a list of idents that are no longer in
+# the scene. If `reset` is set the receiver should throw away its whole scene
+# before applying the rest. See `pong.scene`.
+RenderDelta = namedtuple('RenderDelta', ('reset', 'changed', 'removed'))
+
+# The info for a `predict` message: the ball's `pong.trajectory.Trajectory`,
+# flattened out so it can be sent, with `start` on the `pong.clock.monotonic`
+# clock. `ball` is the ident of the renderable that follows the trajectory,
+# and `followers` those of the renderables that follow its y coordinate (the
+# paddles).
+Prediction = namedtuple(
+    'Prediction',
+    (
+        'start',
+        'position',
+        'direction',
+        'speed',
+        'play_area',
+        'ball',
+        'followers',
+    ),
+)
+
+# These are integers so that they can be written as a single byte by
+# `pong.wire`. `NAMES` is just for debugging.
+QUIT = 0
+RENDER = 1
+FREEZE = 2
+UNFREEZE = 3
+CLIENT_STATE = 4
+RESET = 5
+TIMESTAMP = 6
+PREDICT = 7
+
+NAMES = {
+    QUIT: 'quit',
+    RENDER: 'render',
+    FREEZE: 'freeze',
+    UNFREEZE: 'unfreeze',
+    CLIENT_STATE: 'client_state',
+    RESET: 'reset',
+    TIMESTAMP: 'timestamp',
+    PREDICT: 'predict',
+}
 
 
 # TODO: Should this go here? This file doesn't otherwise know anything about
@@ -28,12 +65,29 @@ def consume_connection_buffer(connection):
     message and discarding the rest. This will block until there is at least
     one message in the queue.
 
-    :param connection: The connection to consume
+    :param connection: The `pong.channel.Channel` to consume
     :return:           The most recently-received message on the connection
     """
-    out = connection.recv()
+    return connection.recv_latest()
+
+
+def drain_connection_buffer(connection, block=True):
+    """
+    Clear a connection's message buffer, returning every message in the order
+    they were sent. Use this instead of `consume_connection_buffer` when
+    messages build on each other (like `reset`s). If `block` is set this will
+    block until there is at least one message in the queue.
+
+    :param connection: The `pong.channel.Channel` to drain
+    :param block:      Whether to wait for a message if there are none
+    :return:           A list of the received messages
+    """
+    if not block and not connection.poll():
+        return []
+
+    out = [connection.recv()]
     while connection.poll():
-        out = connection.recv()
+        out.append(connection.recv())
 
     return out
 
@@ -42,8 +96,11 @@ def client_state(info):
     return Message(type=CLIENT_STATE, info=info)
 
 
-def render(info):
-    return Message(type=RENDER, info=info)
+def render(changed, removed=(), reset=False):
+    return Message(
+        type=RENDER,
+        info=RenderDelta(reset=reset, changed=changed, removed=list(removed)),
+    )
 
 
 def freeze():
@@ -58,6 +115,49 @@ def quit():
     return Message(type=QUIT, info=None)
 
 
+def reset(position=None):
+    """
+    Tell a window that a new game is starting, so it should forget its scene
+    and any freeze, and move back to `position` (if not `None`)
+    """
+    return Message(type=RESET, info=position)
+
+
+def timestamp(seconds):
+    """
+    The time that the rest of a frame is a snapshot of, on the
+    `pong.clock.monotonic` clock (which every process on a machine shares,
+    and windows on other machines translate to theirs, see `pong.net`).
+    Windows use these to interpolate between frames.
+    """
+    return Message(type=TIMESTAMP, info=seconds)
+
+
+def predict(path, start, ball, followers=()):
+    """
+    Tell a window where the ball is going, so it can move the ball and
+    paddles itself until the next bounce
+
+    :param path:      The ball's current `pong.trajectory.Trajectory`
+    :param start:     The `pong.clock.monotonic` time that `path` starts at
+    :param ball:      The ident of the ball's renderable
+    :param followers: The idents of the renderables that follow the ball's y
+                      coordinate
+    """
+    return Message(
+        type=PREDICT,
+        info=Prediction(
+            start=start,
+            position=path.position,
+            direction=path.direction,
+            speed=path.speed,
+            play_area=path.play_area,
+            ball=ball,
+            followers=list(followers),
+        ),
+    )
+
+
 def is_quit(msg):
     return isinstance(msg, Message) and msg.type == QUIT
 
@@ -76,3 +176,15 @@ def is_unfreeze(msg):
 
 def is_client_state(msg):
     return isinstance(msg, Message) and msg.type == CLIENT_STATE
+
+
+def is_reset(msg):
+    return isinstance(msg, Message) and msg.type == RESET
+
+
+def is_timestamp(msg):
+    return isinstance(msg, Message) and msg.type == TIMESTAMP
+
+
+def is_predict(msg):
+    return isinstance(msg, Message) and msg.type == PREDICT
@@ -0,0 +1,118 @@
+"""
+A physics engine for lots of balls at once. Every ball's state lives in NumPy
+arrays and each tick is a handful of array operations, so a few hundred balls
+cost about the same Python overhead as one.
+
+This is only imported when playing with more than one ball, so NumPy isn't
+needed for a normal game.
+"""
+
+import numpy as np
+
+
+class Balls(object):
+    """
+    The state of every ball in the game.
+
+    `positions` is an (N, 2) float array, `directions` an (N, 2) float array
+    of movement directions and `radii` an (N,) integer array. Like the
+    single-ball physics the x component of each direction is always -1 or 1,
+    and the ball moves `speed` pixels along each axis per second (scaled by
+    the direction), so the y component sets the angle. All balls share one
+    speed, which goes up with the score.
+    """
+
+    positions = None
+    directions = None
+    radii = None
+
+    def __init__(self, positions, directions, radii):
+        self.positions = np.asarray(positions, dtype=np.float64)
+        self.directions = np.asarray(directions, dtype=np.float64)
+        self.radii = np.asarray(radii, dtype=np.int32)
+
+    @classmethod
+    def spawn(cls, count, position, radius, seed=None):
+        """
+        Make `count` balls at the same position, heading off in different
+        directions
+
+        :param count:    The number of balls
+        :param position: A two-element tuple of the starting position
+        :param radius:   The radius of every ball
+        :param seed:     A seed for the random directions, or `None`
+        :return:         A `Balls`
+        """
+        random = np.random.RandomState(seed)
+
+        x_directions = np.where(np.arange(count) % 2 == 0, 1.0, -1.0)
+        y_directions = (
+            random.uniform(0.25, 1.0, count) *
+            random.choice([-1.0, 1.0], count)
+        )
+
+        return cls(
+            positions=np.tile(
+                np.asarray(position, dtype=np.float64),
+                (count, 1),
+            ),
+            directions=np.column_stack((x_directions, y_directions)),
+            radii=np.full(count, radius, dtype=np.int32),
+        )
+
+    def __len__(self):
+        return len(self.positions)
+
+    def step(self, speed, dt, play_area):
+        """
+        Advance every ball by one tick, bouncing off the edges of the play
+        area. This follows the same rules as `handle_ball_physics`: the balls
+        move first, and the direction is flipped if the ball was already past
+        an edge and still heading towards it. A ball bouncing off the left or
+        right (i.e. one of the paddles) scores a point.
+
+        :param speed:     The current speed of the balls
+        :param dt:        The length of the tick, in seconds
+        :param play_area: A rectangle tuple of (x, y, width, height) that the
+                          balls' centers must stay in
+        :return:          The number of points scored this tick
+        """
+        area_x, area_y, area_w, area_h = play_area
+        old_x = self.positions[:, 0]
+        old_y = self.positions[:, 1]
+        dir_x = self.directions[:, 0]
+        dir_y = self.directions[:, 1]
+
+        left = (dir_x < 0) & (old_x < area_x)
+        right = (dir_x > 0) & (old_x > area_x + area_w)
+        scored = left | right
+
+        # Like the single-ball version, a ball can only bounce off one edge
+        # per tick, with the paddles taking priority
+        top = ~scored & (dir_y < 0) & (old_y < area_y)
+        bottom = ~scored & (dir_y > 0) & (old_y > area_y + area_h)
+
+        self.positions += self.directions * (speed * dt)
+
+        self.directions[scored, 0] *= -1
+        self.directions[top | bottom, 1] *= -1
+
+        return int(np.count_nonzero(scored))
+
+    def paddle_targets(self):
+        """
+        The paddles follow the ball closest to them, i.e. the left paddle
+        follows the leftmost ball and the right paddle the rightmost.
+
+        :return: A tuple of (left paddle y, right paddle y)
+        """
+        x = self.positions[:, 0]
+        y = self.positions[:, 1]
+
+        return float(y[np.argmin(x)]), float(y[np.argmax(x)])
+
+    def position_list(self):
+        """
+        :return: A list of two-element tuples of each ball's position
+        """
+        return list(map(tuple, self.positions.tolist()))
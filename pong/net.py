@@ -0,0 +1,780 @@
+"""
+Windows on other machines. The game listens for windows to connect (see
+`pong.client`) and talks to each one through a pair of sockets that stand in
+for the two ends of a `pong.channel.pipe`, so neither the game loop nor
+`GameProcess` knows the difference.
+
+Frames go over UDP, since only the newest one matters: a window draws the
+newest frame it has and drops any older one that arrives after it, and a lost
+frame is just replaced by the next one. Everything else (the window's
+settings when it connects, resets, quits and the windows' states) goes over
+a TCP connection, since those have to arrive, and in order. Both carry
+`pong.wire` payloads:
+
+    record   := u32 length, u32 ack, stamp, payload
+    datagram := u32 sequence number, u32 base, stamp, payload
+    stamp    := f64 sent, f64 echo, f64 echoed
+
+Frames are numbered from 1, and every record a window sends acknowledges the
+newest frame it has read (0 for none). Records the game sends have the
+newest frame sent before them in place of an `ack` instead, so that a window
+can drop frames from before a reset that arrive after it. The game can't
+know which frames a window missed until it says, so rather than being deltas
+against the frame before (like they are for local windows), each frame's
+scene is a delta against the newest one the window has acknowledged, which
+is its `base` (0 for a frame with the whole scene, or for an empty frame with
+no scene at all). Both ends keep the scenes of their last `SCENE_HISTORY`
+frames to build on, so a lost frame costs nothing but itself however long
+the acknowledgements take to come back.
+
+Frames say when they're a snapshot of on the game's clock (see
+`messages.timestamp` and `messages.predict`), but clocks on different
+machines don't agree, so windows translate those times to their own clock
+before using them. The `stamp`s are for working out how far apart the two
+clocks are, see `ClockSync`.
+
+NOTE: The game sends frames to the address the window connected from, so
+      each window's UDP port has to be reachable from the game (i.e. no NAT
+      in between). This only supports IPv4.
+"""
+
+import heapq
+import json
+import math
+import random
+import select
+import socket
+import struct
+import time
+
+from collections import OrderedDict, deque
+
+from . import clock, messages, scene, wire
+
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 7777
+
+# The largest UDP payload there is
+MAX_DATAGRAM_SIZE = 65507
+RECV_SIZE = 64 * 1024
+
+# How many frames' scenes each end keeps to build deltas on. A window that
+# takes longer than this many frames to acknowledge one is sent whole scenes.
+SCENE_HISTORY = 128
+
+# How many round trips `ClockSync` picks the quickest of
+CLOCK_SAMPLES = 256
+
+_RECORD = struct.Struct('<IIddd')
+_DATAGRAM = struct.Struct('<IIddd')
+
+# Stands in for times in a `stamp` that aren't known yet
+_UNKNOWN = float('nan')
+
+
+def parse_address(address, default_host=DEFAULT_HOST):
+    """
+    :param address:      A string of "host:port", "host" or ":port"
+    :param default_host: The host to use if `address` doesn't have one
+    :return:             A tuple of (host, port)
+    """
+    host, _, port = address.partition(':')
+
+    return host or default_host, int(port) if port else DEFAULT_PORT
+
+
+def _select(socks, timeout):
+    ready, _, _ = select.select(socks, [], [], timeout)
+    return ready
+
+
+def _split_render(msgs, base_scene):
+    """
+    Apply a frame's `render` messages to the scene they're deltas against
+
+    :param msgs:       A list of messages
+    :param base_scene: A scene dictionary
+    :return:           A tuple of (the resulting scene, list of the messages
+                       that aren't `render`s)
+    """
+    new_scene = base_scene
+    others = []
+
+    for msg in msgs:
+        if messages.is_render(msg):
+            new_scene = scene.apply(new_scene, msg.info)
+        else:
+            others.append(msg)
+
+    return new_scene, others
+
+
+def _remember(scenes, sequence, new_scene):
+    scenes[sequence] = new_scene
+
+    while len(scenes) > SCENE_HISTORY:
+        scenes.popitem(last=False)
+
+
+def _to_local(msgs, sync):
+    """
+    Translate the times in a list of messages from the game's clock to ours
+
+    :param msgs: A list of messages
+    :param sync: The connection's `ClockSync`
+    :return:     A list of messages
+    """
+    out = []
+
+    for msg in msgs:
+        if messages.is_timestamp(msg):
+            msg = messages.timestamp(sync.to_local(msg.info))
+        elif messages.is_predict(msg):
+            msg = msg._replace(
+                info=msg.info._replace(start=sync.to_local(msg.info.start)),
+            )
+
+        out.append(msg)
+
+    return out
+
+
+class ClockSync(object):
+    """
+    Works out how far ahead of this machine's clock the other end's is, like
+    NTP does. Everything sent either way is stamped with when it was sent,
+    along with the `sent` stamp of the newest thing that came the other way
+    and when that arrived, so everything that arrives measures a round trip.
+    Each way is taken to be half of the round trip, and the offset from the
+    quickest of the last `samples` round trips is used, since a quick round
+    trip can't have been held up much either way.
+
+    :param clock:   A function returning this machine's time in seconds,
+                    e.g. `pong.clock.monotonic`
+    :param samples: How many of the latest round trips to use the quickest of
+    """
+
+    offset = None
+
+    def __init__(self, clock, samples=CLOCK_SAMPLES):
+        self._clock = clock
+        self._samples = deque(maxlen=samples)
+
+        # The `sent` stamp of the newest thing from the other end, and when
+        # it arrived on our clock
+        self._their_sent = None
+        self._arrived = None
+
+    def stamp(self):
+        """
+        :return: A tuple of (`sent`, `echo`, `echoed`) to send
+        """
+        if self._their_sent is None:
+            return self._clock(), _UNKNOWN, _UNKNOWN
+
+        return self._clock(), self._their_sent, self._arrived
+
+    def arrived(self, sent, echo, echoed):
+        """
+        Take in the stamp of something that just arrived from the other end
+        """
+        now = self._clock()
+
+        if self._their_sent is None or sent > self._their_sent:
+            self._their_sent = sent
+            self._arrived = now
+
+        # Nothing of ours had got to the other end when this was sent
+        if math.isnan(echo):
+            return
+
+        round_trip = (now - echo) - (sent - echoed)
+        offset = ((echoed - echo) + (sent - now)) / 2
+
+        self._samples.append((round_trip, offset))
+        self.offset = min(self._samples)[1]
+
+    def to_local(self, seconds):
+        """
+        :param seconds: A time on the other end's clock
+        :return:        The same time on ours
+        """
+        if self.offset is None:
+            return seconds
+
+        return seconds - self.offset
+
+
+class _Stream(object):
+    """
+    Reads and writes `record`s on a TCP socket
+
+    :param sock: The socket
+    :param sync: The connection's `ClockSync`, which stamps every record
+    """
+
+    sock = None
+    sync = None
+    closed = None
+
+    def __init__(self, sock, sync):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.sock = sock
+        self.sync = sync
+        self.closed = False
+
+        self._buffer = b''
+
+    def read(self, timeout=0):
+        """
+        Read whatever has arrived on the socket, waiting for something to if
+        nothing has
+
+        :param timeout: The longest to wait, in seconds, or `None` to wait
+                        forever
+        """
+        if self.closed or not _select([self.sock], timeout):
+            return
+
+        try:
+            data = self.sock.recv(RECV_SIZE)
+        except socket.error:
+            data = b''
+
+        if not data:
+            self.closed = True
+
+        self._buffer += data
+
+    def has_record(self):
+        if len(self._buffer) < _RECORD.size:
+            return False
+
+        length = _RECORD.unpack_from(self._buffer)[0]
+
+        return len(self._buffer) >= _RECORD.size + length
+
+    def next_record(self, block=True):
+        """
+        :param block: Whether to wait for a whole record to arrive
+        :return:      A tuple of (ack, payload), or `None` if there isn't a
+                      whole record and either `block` isn't set or the other
+                      end hung up
+        """
+        while not self.has_record():
+            if self.closed or not block:
+                return None
+
+            self.read(None)
+
+        length, ack, sent, echo, echoed = _RECORD.unpack_from(self._buffer)
+        self.sync.arrived(sent, echo, echoed)
+
+        end = _RECORD.size + length
+        payload = self._buffer[_RECORD.size:end]
+        self._buffer = self._buffer[end:]
+
+        return ack, payload
+
+    def send(self, payload, ack=0):
+        if self.closed:
+            return
+
+        try:
+            self.sock.sendall(
+                _RECORD.pack(len(payload), ack, *self.sync.stamp()) + payload
+            )
+        except socket.error:
+            self.closed = True
+
+
+class ServerChannel(object):
+    """
+    The game's end of a window's connection, with the same methods as the
+    `pong.channel.Channel` the game would use for a local window. A window
+    that hangs up is treated as having quit.
+
+    :param stream:  The `_Stream` to the window
+    :param udp:     A UDP socket to send frames from
+    :param address: The (host, port) to send the window frames at
+    :param encode:  A function turning a message into bytes
+    :param decode:  The inverse of `encode`
+    """
+
+    def __init__(
+        self,
+        stream,
+        udp,
+        address,
+        encode=wire.encode,
+        decode=wire.decode,
+    ):
+        self._stream = stream
+        self._udp = udp
+        self._address = address
+        self._encode = encode
+        self._decode = decode
+        self._hung_up = False
+
+        self._sent = 0
+        self._acked = 0
+        self._dropped = 0
+
+        # The scene as of the last frame sent, which its `render` was a delta
+        # against
+        self._last_scene = {}
+
+        # The scene each of the last `SCENE_HISTORY` frames left the window
+        # with, by sequence number
+        self._scenes = OrderedDict()
+
+    def _take(self, record):
+        if record is None:
+            # The window hung up
+            self._hung_up = True
+            return messages.quit()
+
+        ack, payload = record
+
+        # Acknowledgements only ever go up, and any frame that was skipped
+        # over was either lost or replaced before the window read it
+        if ack > self._acked:
+            self._dropped += ack - self._acked - 1
+            self._acked = ack
+
+        return self._decode(payload)
+
+    def send(self, msgs):
+        # The window forgets its scene when it's reset, so nothing sent
+        # before this can be built on
+        if any(messages.is_reset(msg) for msg in msgs):
+            self._scenes.clear()
+
+        self._stream.send(self._encode(msgs), ack=self._sent)
+
+    def send_frame(self, msgs):
+        """
+        Send the window a frame. Like for a local window, its `render` is a
+        delta against the last frame sent, but what goes over the network is
+        a delta against the newest frame the window has acknowledged.
+
+        An empty frame goes without any `render` at all, since it's only sent
+        to replace one the window hasn't read (see `reset_window_pool`) and
+        the scene it would otherwise rebuild is the one being replaced.
+        """
+        new_scene, others = _split_render(msgs, self._last_scene)
+        self._last_scene = new_scene
+        self._sent += 1
+
+        if not msgs:
+            # Leaves the window's scene as it is, so there's nothing to
+            # build on either
+            base = 0
+        else:
+            if self._acked in self._scenes:
+                base = self._acked
+                render_msg = scene.diff(self._scenes[base], new_scene)
+            else:
+                base = 0
+                render_msg = scene.diff(None, new_scene)
+
+            if render_msg is not None:
+                others.append(render_msg)
+
+            _remember(self._scenes, self._sent, new_scene)
+
+        datagram = _DATAGRAM.pack(
+            self._sent,
+            base,
+            *self._stream.sync.stamp()
+        ) + self._encode(others)
+
+        if len(datagram) > MAX_DATAGRAM_SIZE:
+            raise ValueError(
+                'A frame of {} bytes does not fit in a datagram'.format(
+                    len(datagram)
+                )
+            )
+
+        try:
+            self._udp.sendto(datagram, self._address)
+        except socket.error:
+            # Same as the frame being lost on the way
+            pass
+
+    def frame_pending(self):
+        """
+        Frames only build on ones the window is known to have (see
+        `send_frame`), so the window never needs sending the whole scene
+        """
+        return False
+
+    def frames_dropped(self):
+        return self._dropped
+
+    def full(self):
+        return False
+
+    def dropped(self):
+        return 0
+
+    def poll(self):
+        self._stream.read(0)
+
+        # A hang up is only worth one `quit`
+        return self._stream.has_record() or (
+            self._stream.closed and not self._hung_up
+        )
+
+    def recv(self):
+        return self._take(self._stream.next_record())
+
+    def recv_latest(self):
+        out = self.recv()
+        self._stream.read(0)
+
+        while self._stream.has_record():
+            out = self.recv()
+
+        return out
+
+    def bell(self):
+        """
+        :return: The TCP socket, which is readable whenever the window has
+                 sent something (or hung up)
+        """
+        return self._stream.sock
+
+
+class Impairment(object):
+    """
+    Simulates a bad network by losing and delaying datagrams, for trying out
+    networked windows on one machine.
+
+    :param loss:    The probability of losing each datagram, from 0 to 1
+    :param latency: How long to delay each datagram by, in seconds
+    :param seed:    A seed for deciding which datagrams are lost, or `None`
+    :param clock:   A function returning the current time in seconds
+    """
+
+    loss = None
+    latency = None
+    lost = None
+
+    def __init__(self, loss=0.0, latency=0.0, seed=None, clock=time.time):
+        self.loss = loss
+        self.latency = latency
+        self.lost = 0
+
+        self._random = random.Random(seed)
+        self._clock = clock
+        self._queue = []
+        self._count = 0
+
+    def push(self, datagram):
+        if self._random.random() < self.loss:
+            self.lost += 1
+            return
+
+        # The count keeps datagrams that are due at the same time in order
+        heapq.heappush(
+            self._queue,
+            (self._clock() + self.latency, self._count, datagram),
+        )
+        self._count += 1
+
+    def next_due(self):
+        """
+        :return: When the next datagram is due, or `None` if there isn't one
+        """
+        return self._queue[0][0] if self._queue else None
+
+    def pop_due(self):
+        """
+        :return: A list of the datagrams that are due, oldest first
+        """
+        now = self._clock()
+        out = []
+
+        while self._queue and self._queue[0][0] <= now:
+            out.append(heapq.heappop(self._queue)[2])
+
+        return out
+
+
+class ClientChannel(object):
+    """
+    The window's end of its connection to the game, with the same methods as
+    the `pong.channel.Channel` a `GameProcess` is normally given. If the game
+    hangs up, this says it quit.
+
+    :param stream:     The `_Stream` to the game
+    :param udp:        The UDP socket the game sends frames to
+    :param impairment: An `Impairment` to pass the frames through, or `None`
+    :param encode:     A function turning a message into bytes
+    :param decode:     The inverse of `encode`
+    """
+
+    def __init__(
+        self,
+        stream,
+        udp,
+        impairment=None,
+        encode=wire.encode,
+        decode=wire.decode,
+    ):
+        self._stream = stream
+        self._udp = udp
+        self._impairment = impairment
+        self._encode = encode
+        self._decode = decode
+        self._hung_up = False
+
+        # The newest frame that's arrived (or that was sent before the last
+        # reset, if that's newer), and the newest one that's been read
+        self._latest = 0
+        self._frame = None
+        self._acked = 0
+
+        # The scenes of the last `SCENE_HISTORY` frames read, which the game
+        # builds new frames on
+        self._scenes = OrderedDict()
+
+    def _offer(self, datagram):
+        sequence = _DATAGRAM.unpack_from(datagram)[0]
+
+        # Anything older than what we've already got arrived out of order
+        if sequence > self._latest:
+            self._latest = sequence
+            self._frame = datagram
+
+    def _read_frames(self):
+        while _select([self._udp], 0):
+            datagram, _ = self._udp.recvfrom(MAX_DATAGRAM_SIZE)
+
+            # Timed as it arrives rather than once the impairment lets it
+            # through, so that a delayed frame looks late rather than like
+            # the clocks moved apart
+            self._stream.sync.arrived(*_DATAGRAM.unpack_from(datagram)[2:])
+
+            if self._impairment is None:
+                self._offer(datagram)
+            else:
+                self._impairment.push(datagram)
+
+        if self._impairment is not None:
+            for datagram in self._impairment.pop_due():
+                self._offer(datagram)
+
+    def send(self, msgs):
+        self._stream.send(self._encode(msgs), ack=self._acked)
+
+    def recv_frame(self):
+        """
+        :return: The newest frame, or `None` if there's no new one. Its
+                 `render` always has the whole scene, since the window's
+                 scene might not be the one the game built the frame on,
+                 unless it's an empty frame, which has no `render`
+        """
+        self._read_frames()
+
+        if self._frame is None:
+            return None
+
+        datagram = self._frame
+        self._frame = None
+
+        sequence, base = _DATAGRAM.unpack_from(datagram)[:2]
+        self._acked = sequence
+
+        if base and base not in self._scenes:
+            # The game only builds on frames we've acknowledged, and we keep
+            # as many as it does, so this can't happen
+            return None
+
+        msgs = self._decode(datagram[_DATAGRAM.size:])
+
+        if not base and not any(messages.is_render(msg) for msg in msgs):
+            # An empty frame, which leaves the scene as it is
+            return _to_local(msgs, self._stream.sync)
+
+        new_scene, msgs = _split_render(
+            msgs,
+            self._scenes[base] if base else {},
+        )
+        msgs = _to_local(msgs, self._stream.sync)
+        msgs.append(scene.diff(None, new_scene))
+
+        _remember(self._scenes, sequence, new_scene)
+
+        return msgs
+
+    def frame_pending(self):
+        self._read_frames()
+
+        return self._frame is not None
+
+    def poll(self):
+        self._stream.read(0)
+
+        # A hang up is only worth one `quit`
+        return self._stream.has_record() or (
+            self._stream.closed and not self._hung_up
+        )
+
+    def recv(self):
+        record = self._stream.next_record()
+
+        if record is None:
+            # The game hung up. It sends lists of messages, so this is one too
+            self._hung_up = True
+            return [messages.quit()]
+
+        last_sent, payload = record
+        msgs = self._decode(payload)
+
+        if any(messages.is_reset(msg) for msg in msgs):
+            # Frames sent before the reset are of the old scene, which the
+            # game has forgotten too, so drop any that are still to come
+            self._scenes.clear()
+
+            if last_sent >= self._latest:
+                self._latest = last_sent
+                self._frame = None
+
+        return _to_local(msgs, self._stream.sync)
+
+    def wait(self, timeout=None):
+        """
+        Sleep until there's a message or a frame to read
+
+        :param timeout: The longest to wait for, in seconds, or `None` to wait
+                        forever
+        :return:        Whether there's anything to read
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        while not (self.poll() or self.frame_pending()):
+            wait_until = deadline
+
+            # Wake up for delayed frames coming due, too
+            if self._impairment is not None:
+                due = self._impairment.next_due()
+
+                if due is not None and (
+                    wait_until is None or due < wait_until
+                ):
+                    wait_until = due
+
+            if wait_until is None:
+                remaining = None
+            else:
+                remaining = max(wait_until - time.time(), 0)
+
+            _select([self._stream.sock, self._udp], remaining)
+
+            if deadline is not None and time.time() >= deadline:
+                return self.poll() or self.frame_pending()
+
+        return True
+
+
+def game_process_spec(game_process):
+    """
+    :param game_process: A `GameProcess`
+    :return:             A dictionary of its arguments, to send to a window
+    """
+    return dict(
+        position=game_process.position,
+        size=game_process.size,
+        centered=game_process.centered,
+        pinned=game_process.pinned,
+        present_fps=game_process.present_fps,
+    )
+
+
+def serve_windows(address, layout, out=None):
+    """
+    Wait for a window to connect for each of a list of `GameProcess`es. Each
+    window is sent the arguments of the next `GameProcess`, in the order they
+    connect.
+
+    :param address: The "host:port" to listen on
+    :param layout:  A list of `GameProcess`es (see `window_layout`)
+    :param out:     A file to say what's being waited for on, or `None`
+    :return:        A list of `ServerChannel`s, one for each `GameProcess`
+    """
+    host, port = parse_address(address)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(len(layout))
+
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    if out is not None:
+        out.write(
+            'Waiting for {} windows, run `python -m pong.client '
+            '<this host>:{}` for each\n'.format(len(layout), port)
+        )
+        out.flush()
+
+    chans = []
+
+    for game_process in layout:
+        sock, (peer_host, _) = listener.accept()
+        stream = _Stream(sock, ClockSync(clock.monotonic))
+
+        hello = stream.next_record()
+
+        if hello is None:
+            raise IOError('A window hung up before saying hello')
+
+        udp_port = json.loads(hello[1].decode('utf-8'))['udp_port']
+        stream.send(
+            json.dumps(game_process_spec(game_process)).encode('utf-8')
+        )
+
+        chans.append(ServerChannel(stream, udp, (peer_host, udp_port)))
+
+    listener.close()
+
+    return chans
+
+
+def connect(address, impairment=None):
+    """
+    Connect a window to a game
+
+    :param address:    The "host:port" the game is listening on
+    :param impairment: An `Impairment` to pass frames through, or `None`
+    :return:           A tuple of (dictionary of arguments for the window's
+                       `GameProcess`, `ClientChannel`)
+    """
+    host, port = parse_address(address, default_host='127.0.0.1')
+
+    stream = _Stream(
+        socket.create_connection((host, port)),
+        ClockSync(clock.monotonic),
+    )
+
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp.bind(('', 0))
+
+    stream.send(
+        json.dumps(dict(udp_port=udp.getsockname()[1])).encode('utf-8')
+    )
+    welcome = stream.next_record()
+
+    if welcome is None:
+        raise IOError('The game hung up before sending any settings')
+
+    # JSON doesn't have tuples, but all of the arguments' sequences are
+    spec = dict(
+        (name, tuple(value) if isinstance(value, list) else value)
+        for name, value in json.loads(welcome[1].decode('utf-8')).items()
+    )
+
+    return spec, ClientChannel(stream, udp, impairment)
@@ -35,8 +35,6 @@ def any_contains(inner, outers):
     )
 
 
-# TODO: Currently unused - should be used for checking whether or not a
-#       `Renderable` should be sent to a client
 def intersects(a_rect, b_rect):
     """
     Check if two rectangles intersect
@@ -56,7 +54,116 @@ def intersects(a_rect, b_rect):
     b_t = b_rect[1]
     b_b = b_rect[1] + b_rect[3]
 
-    intersects_y = a_t < b_b or a_b > b_t
-    intersects_x = a_l < b_r or a_r > b_l
+    intersects_y = a_t < b_b and a_b > b_t
+    intersects_x = a_l < b_r and a_r > b_l
 
     return intersects_y and intersects_x
+
+
+DEFAULT_CELL_SIZE = 256
+
+
+class GridIndex(object):
+    """
+    A uniform grid of rectangles, for finding which rectangles contain a
+    point without checking every one of them.
+
+    Each rectangle is stored in every cell of the grid that it overlaps, so
+    a lookup only has to check the rectangles in the point's cell. Moving a
+    rectangle only touches the cells it left and entered, and setting a
+    rectangle to the same value it already had costs a single comparison.
+    """
+
+    cell_size = None
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        """
+        :param cell_size: The width and height of each cell. This should be
+                          about the size of a typical rectangle
+        """
+        self.cell_size = cell_size
+
+        self._rects = {}
+        self._cells = {}
+
+    def __len__(self):
+        return len(self._rects)
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def _cells_of(self, rect):
+        x, y, w, h = rect
+        min_x, min_y = self._cell(x, y)
+        max_x, max_y = self._cell(x + w, y + h)
+
+        return [
+            (cell_x, cell_y)
+            for cell_x in range(min_x, max_x + 1)
+            for cell_y in range(min_y, max_y + 1)
+        ]
+
+    def update(self, key, rect):
+        """
+        Add, move or remove a rectangle
+
+        :param key:  Any hashable value to identify the rectangle by
+        :param rect: The rectangle tuple (x, y, width, height), or `None` to
+                     remove it
+        """
+        old_rect = self._rects.get(key)
+
+        if old_rect == rect:
+            return
+
+        old_cells = set(self._cells_of(old_rect)) if old_rect else set()
+        new_cells = set(self._cells_of(rect)) if rect else set()
+
+        for cell in old_cells - new_cells:
+            keys = self._cells[cell]
+            keys.discard(key)
+
+            if not keys:
+                del self._cells[cell]
+
+        for cell in new_cells - old_cells:
+            self._cells.setdefault(cell, set()).add(key)
+
+        if rect is None:
+            del self._rects[key]
+        else:
+            self._rects[key] = rect
+
+    def containing(self, point):
+        """
+        :param point: A two-element tuple of (x, y)
+        :return:      A list of the keys of every rectangle containing `point`
+        """
+        keys = self._cells.get(self._cell(*point))
+
+        if not keys:
+            return []
+
+        return [key for key in keys if contains(point, self._rects[key])]
+
+    def any_containing(self, point):
+        """
+        :param point: A two-element tuple of (x, y)
+        :return:      `True` if any rectangle contains `point`
+        """
+        keys = self._cells.get(self._cell(*point), ())
+
+        return any(contains(point, self._rects[key]) for key in keys)
+
+    def occupied(self, points):
+        """
+        :param points: An enumerable of two-element tuples of (x, y)
+        :return:       A set of the keys of every rectangle containing at
+                       least one of `points`
+        """
+        out = set()
+
+        for point in points:
+            out.update(self.containing(point))
+
+        return out
@@ -0,0 +1,18 @@
+"""
+Imported by the fork server that the windows are started from (see `spawner`
+in `pong.__main__`) before it forks any of them, so that every window starts
+with this work already done instead of each doing it again.
+
+Only work that can be shared between processes belongs here. In particular
+nothing in SDL is initialised, since that doesn't survive a fork (and the
+display connection it opens would end up shared by every window).
+"""
+
+import pygame
+import pygame.sysfont
+
+from . import game
+
+# Looking up the system's fonts runs `fc-list` on Linux, which takes longer
+# than everything else a window does to start up put together
+pygame.sysfont.initsysfonts()
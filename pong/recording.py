@@ -0,0 +1,460 @@
+"""
+Recording games tick by tick, and playing the recordings back (see
+`pong.replay`).
+
+A recording holds everything that goes into a tick of `run_game` from
+outside: how long the frame was and what each window reported, along with
+enough of what came out of it (the balls, the score and which windows were
+frozen) to check that a replay went the same way. Everything is
+little-endian, laid out as:
+
+    recording := "PONGREC1", u32 length, options JSON, game...
+    game      := u8 GAME, u32 seed, i32 last score, i32 highscore, tick...
+    tick      := u8 TICK, u8 broadcast, f64 dt, u32 score, u16 balls,
+                 u16 frozen, u16 responses, u16 updates, f32 x, f32 y...,
+                 u16 index..., window..., window...
+    window    := u16 index, i32 x, i32 y, u32 width, u32 height
+
+The last score is -1 for the first game. `responses` are the window states
+received while sending the frame and `updates` the ones received while
+waiting for this frame to start (i.e. at the end of the last one), in the
+order they arrived.
+
+Recordings are read through `mmap`, so replaying a long session doesn't mean
+reading it all into memory first.
+"""
+
+import json
+import mmap
+import random
+import struct
+
+from collections import namedtuple
+
+from . import messages
+from .windowing import WindowInfo
+
+MAGIC = b'PONGREC1'
+
+GAME = 1
+TICK = 2
+
+WINDOW_RECORD = 'HiiII'
+
+_BYTE = struct.Struct('<B')
+_HEADER = struct.Struct('<8sI')
+_GAME = struct.Struct('<BIii')
+_TICK = struct.Struct('<BBdIHHHH')
+
+_BATCH_STRUCTS = {}
+
+# One tick of a game, see the module docstring. `ball_positions` is a list of
+# two-element tuples, `frozen` a list of window indices and `responses` and
+# `updates` lists of (window index, `WindowInfo`).
+Tick = namedtuple(
+    'Tick',
+    (
+        'broadcast',
+        'dt',
+        'score',
+        'ball_positions',
+        'frozen',
+        'responses',
+        'updates',
+    ),
+)
+
+
+def _batch_struct(record, count):
+    """
+    Get a (cached) `struct.Struct` for `count` back-to-back records, like
+    `pong.wire` does
+    """
+    key = record, count
+
+    if key not in _BATCH_STRUCTS:
+        _BATCH_STRUCTS[key] = struct.Struct('<' + record * count)
+
+    return _BATCH_STRUCTS[key]
+
+
+def _chunks(values, size):
+    return zip(*[iter(values)] * size)
+
+
+def encode_tick(tick):
+    """
+    :param tick: A `Tick`
+    :return:     The tick's record, as bytes
+    """
+    windows = list(tick.responses) + list(tick.updates)
+
+    return b''.join(
+        [
+            _TICK.pack(
+                TICK,
+                tick.broadcast,
+                tick.dt,
+                tick.score,
+                len(tick.ball_positions),
+                len(tick.frozen),
+                len(tick.responses),
+                len(tick.updates),
+            ),
+            _batch_struct('ff', len(tick.ball_positions)).pack(
+                *[coord for pos in tick.ball_positions for coord in pos]
+            ),
+            _batch_struct('H', len(tick.frozen)).pack(*tick.frozen),
+            _batch_struct(WINDOW_RECORD, len(windows)).pack(
+                *[
+                    value
+                    for index, info in windows
+                    for value in (index,) + tuple(info)
+                ]
+            ),
+        ]
+    )
+
+
+def decode_tick(data, offset=0):
+    """
+    :param data:   A buffer with a tick record in it, e.g. a `mmap`
+    :param offset: Where in `data` the record starts
+    :return:       A tuple of (`Tick`, offset of the end of the record)
+    """
+    (
+        _,
+        broadcast,
+        dt,
+        score,
+        num_balls,
+        num_frozen,
+        num_responses,
+        num_updates,
+    ) = _TICK.unpack_from(data, offset)
+    offset += _TICK.size
+
+    balls_struct = _batch_struct('ff', num_balls)
+    ball_positions = list(
+        _chunks(balls_struct.unpack_from(data, offset), 2)
+    )
+    offset += balls_struct.size
+
+    frozen_struct = _batch_struct('H', num_frozen)
+    frozen = list(frozen_struct.unpack_from(data, offset))
+    offset += frozen_struct.size
+
+    windows_struct = _batch_struct(
+        WINDOW_RECORD,
+        num_responses + num_updates,
+    )
+    windows = [
+        (index, WindowInfo(x=x, y=y, width=width, height=height))
+        for index, x, y, width, height in _chunks(
+            windows_struct.unpack_from(data, offset),
+            5,
+        )
+    ]
+    offset += windows_struct.size
+
+    return Tick(
+        broadcast=bool(broadcast),
+        dt=dt,
+        score=score,
+        ball_positions=ball_positions,
+        frozen=frozen,
+        responses=windows[:num_responses],
+        updates=windows[num_responses:],
+    ), offset
+
+
+def client_states(msgs):
+    """
+    Pick out the window states from a list of messages, for a `Tick`
+
+    :param msgs: An enumerable of (window index, message or `None`)
+    :return:     A list of (window index, `WindowInfo`)
+    """
+    return [
+        (index, msg.info)
+        for index, msg in msgs
+        if msg is not None and messages.is_client_state(msg)
+    ]
+
+
+class Recorder(object):
+    """
+    Writes a recording of every game played to a file.
+
+    :param out:     A file opened for writing bytes
+    :param options: A dictionary of the options the games are played with.
+                    This must be serialisable as JSON
+    """
+
+    def __init__(self, out, options):
+        options_json = json.dumps(options).encode('utf-8')
+
+        self._out = out
+        self._out.write(_HEADER.pack(MAGIC, len(options_json)))
+        self._out.write(options_json)
+
+    def start_game(self, last_score, highscore):
+        """
+        Start recording a new game
+
+        :param last_score: The score of the last game, or `None`
+        :param highscore:  The highscore
+        :return:           The seed to use for anything random in the game
+        """
+        seed = random.randrange(2 ** 32)
+
+        # Anything left over from the last game can go to disk now
+        self._out.flush()
+        self._out.write(
+            _GAME.pack(
+                GAME,
+                seed,
+                -1 if last_score is None else last_score,
+                highscore,
+            )
+        )
+
+        return seed
+
+    def record_tick(self, tick):
+        """
+        :param tick: A `Tick`
+        """
+        self._out.write(encode_tick(tick))
+
+    def close(self):
+        self._out.close()
+
+
+class GameReplay(object):
+    """
+    One game of a `Recording`, read a tick at a time.
+
+    As the game is replayed, pass each tick it produces to `check`, which
+    counts the ticks that didn't come out the same as in the recording.
+    """
+
+    seed = None
+    last_score = None
+    highscore = None
+    ticks = None
+    diverged = None
+    first_divergence = None
+
+    def __init__(self, data, offset):
+        _, seed, last_score, highscore = _GAME.unpack_from(data, offset)
+
+        self.seed = seed
+        self.last_score = None if last_score < 0 else last_score
+        self.highscore = highscore
+        self.ticks = 0
+        self.diverged = 0
+
+        self._data = data
+        self._offset = offset + _GAME.size
+        self._last_tick = None
+
+    def _at_tick(self):
+        return (
+            self._offset < len(self._data) and
+            _BYTE.unpack_from(self._data, self._offset)[0] == TICK
+        )
+
+    def next_tick(self):
+        """
+        :return: The next `Tick`, or `None` if the game ended
+        """
+        if not self._at_tick():
+            self._last_tick = None
+            return None
+
+        try:
+            self._last_tick, self._offset = decode_tick(
+                self._data,
+                self._offset,
+            )
+        except struct.error:
+            # The game was killed partway through writing this tick
+            self._offset = len(self._data)
+            self._last_tick = None
+            return None
+
+        self.ticks += 1
+
+        return self._last_tick
+
+    def skip(self):
+        """
+        Skip any ticks that haven't been read
+
+        :return: The offset of the end of the game
+        """
+        while self._at_tick():
+            self.next_tick()
+
+        return self._offset
+
+    def check(self, tick):
+        """
+        Compare a replayed tick to the last one read. The replayed balls are
+        rounded the same way the recorded ones were.
+
+        :param tick: A `Tick` of what the replay did
+        :return:     Whether it matches the recording
+        """
+        replayed, _ = decode_tick(encode_tick(tick))
+        recorded = self._last_tick
+
+        matches = (
+            replayed.score == recorded.score and
+            replayed.ball_positions == recorded.ball_positions and
+            replayed.frozen == recorded.frozen
+        )
+
+        if not matches:
+            self.diverged += 1
+
+            if self.first_divergence is None:
+                self.first_divergence = self.ticks
+
+        return matches
+
+
+class Recording(object):
+    """
+    A recording made by a `Recorder`, memory-mapped.
+
+    :param path: The path of the recording
+    """
+
+    options = None
+
+    def __init__(self, path):
+        with open(path, 'rb') as recording_file:
+            self._data = mmap.mmap(
+                recording_file.fileno(),
+                0,
+                access=mmap.ACCESS_READ,
+            )
+
+        magic, options_length = _HEADER.unpack_from(self._data, 0)
+
+        if magic != MAGIC:
+            raise ValueError('{} is not a pong recording'.format(path))
+
+        options_end = _HEADER.size + options_length
+
+        # JSON doesn't have tuples, but all of the options' sequences are
+        self.options = dict(
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in json.loads(
+                self._data[_HEADER.size:options_end].decode('utf-8')
+            ).items()
+        )
+
+        self._games_offset = options_end
+
+    def games(self):
+        """
+        :return: An iterator of a `GameReplay` for each game. Each one must be
+                 finished with before moving on to the next
+        """
+        offset = self._games_offset
+
+        while offset < len(self._data):
+            game = GameReplay(self._data, offset)
+
+            yield game
+
+            offset = game.skip()
+
+    def close(self):
+        self._data.close()
+
+
+class ReplayScheduler(object):
+    """
+    Stands in for a `clock.FrameScheduler` when replaying a game, so that it
+    runs as fast as it can. Each frame starts straight away, and the clock
+    moves on by the recorded frame length.
+
+    The tick for the frame being played is in `tick`, which is `None` once
+    the recording of the game runs out.
+
+    :param game:         A `GameReplay`
+    :param frame_length: The length of a frame, in seconds
+    """
+
+    frame_length = None
+    spin_time = 0
+    deadline = None
+    missed = 0
+    tick = None
+
+    def __init__(self, game, frame_length):
+        self.frame_length = frame_length
+
+        self._game = game
+        self._now = 0.0
+
+        self.deadline = frame_length
+
+    def clock(self):
+        return self._now
+
+    def start_frame(self):
+        self.tick = self._game.next_tick()
+
+        if self.tick is not None:
+            self._now += self.tick.dt
+
+        self.deadline = self._now + self.frame_length
+
+        return self._now
+
+    def remaining(self):
+        return self.deadline - self._now
+
+    def wait(self):
+        pass
+
+
+class NullWindow(object):
+    """
+    Stands in for the `pong.channel.Channel` to a window when replaying. It
+    never has anything to say, since the replay supplies what the windows
+    said, and frames sent to it are encoded (so that the replay does the same
+    work as the game) and then thrown away.
+
+    :param encode: A function turning a message into bytes, or `None`
+    """
+
+    def __init__(self, encode=None):
+        self._encode = encode
+
+    def send(self, msgs):
+        if self._encode is not None:
+            self._encode(msgs)
+
+    def send_frame(self, msgs):
+        self.send(msgs)
+
+    def frame_pending(self):
+        return False
+
+    def frames_dropped(self):
+        return 0
+
+    def full(self):
+        return False
+
+    def dropped(self):
+        return 0
+
+    def poll(self):
+        return False
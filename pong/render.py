@@ -1,10 +1,27 @@
-import pygame
+"""
+Everything the windows know how to draw.
+
+NOTE: `pygame` is only imported by the methods that draw, since the game's
+      parent process builds renderables every frame but never draws any, and
+      importing `pygame` is a noticeable part of its startup time.
+"""
+
+import copy
+
+from collections import OrderedDict
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 DEFAULT_FONT = None
+DEFAULT_FONT_NAME = 'monospace'
 DEFAULT_FONT_SIZE = 15
 
+# The font size is in points, and a line of text is taller than that in
+# pixels (how much taller depends on the font), so this is an overestimate of
+# how tall a `Text` is that holds for any sensible font
+TEXT_HEIGHT = 2 * DEFAULT_FONT_SIZE
+DEFAULT_TEXT_CACHE_SIZE = 64
+
 
 def default_font():
     """
@@ -14,31 +31,189 @@ def default_font():
     global DEFAULT_FONT
 
     if DEFAULT_FONT is None:
-        DEFAULT_FONT = pygame.font.SysFont('monospace', DEFAULT_FONT_SIZE)
+        import pygame
+
+        DEFAULT_FONT = pygame.font.SysFont(
+            DEFAULT_FONT_NAME,
+            DEFAULT_FONT_SIZE,
+        )
 
     return DEFAULT_FONT
 
 
+class TextCache(object):
+    """
+    A bounded LRU cache of rendered text surfaces, keyed by (text, font name,
+    font size, color).
+
+    On a miss the text isn't rasterized as a whole. Instead it's assembled from
+    individually cached glyphs, so text that changes all the time (like the
+    FPS counter) only ever rasterizes each character once. This relies on the
+    font being monospace, since glyphs are placed side by side with no kerning.
+    """
+
+    max_size = None
+    hits = None
+    misses = None
+    glyph_hits = None
+    glyph_misses = None
+
+    def __init__(self, max_size=DEFAULT_TEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.glyph_hits = 0
+        self.glyph_misses = 0
+
+        self._surfaces = OrderedDict()
+        self._glyphs = {}
+
+    def glyph(self, font, font_key, char, color):
+        """
+        Get the surface for a single character, rasterizing it if necessary.
+        Glyphs are never evicted, since there are only so many characters.
+        """
+        key = font_key + (char, color)
+
+        if key in self._glyphs:
+            self.glyph_hits += 1
+        else:
+            self.glyph_misses += 1
+            self._glyphs[key] = font.render(char, True, color)
+
+        return self._glyphs[key]
+
+    def render(self, font, font_key, text, color):
+        """
+        Get the surface for a string, drop-in for `font.render(text, True,
+        color)`.
+
+        :param font:     A `pygame.font.Font`
+        :param font_key: A tuple of (font name, font size) identifying `font`
+        :param text:     The string to render
+        :param color:    An RGB tuple
+        :return:         A `pygame.Surface` with per-pixel alpha
+        """
+        key = (text,) + font_key + (color,)
+
+        # Popping and re-inserting moves the entry to the most-recently-used
+        # end of the dictionary
+        surface = self._surfaces.pop(key, None)
+
+        if surface is not None:
+            self.hits += 1
+        else:
+            import pygame
+
+            self.misses += 1
+
+            glyphs = [
+                self.glyph(font, font_key, char, color)
+                for char in text
+            ]
+            surface = pygame.Surface(
+                (
+                    sum(glyph.get_width() for glyph in glyphs),
+                    font.get_height(),
+                ),
+                pygame.SRCALPHA,
+            )
+
+            x = 0
+            for glyph in glyphs:
+                # The glyphs don't overlap and the surface starts out fully
+                # transparent, so taking the max copies each glyph's pixels
+                # (including alpha) instead of blending them with black
+                surface.blit(
+                    glyph,
+                    (x, 0),
+                    special_flags=pygame.BLEND_RGBA_MAX,
+                )
+                x += glyph.get_width()
+
+            if len(self._surfaces) >= self.max_size:
+                self._surfaces.popitem(last=False)
+
+        self._surfaces[key] = surface
+
+        return surface
+
+    def stats(self):
+        """
+        :return: A dictionary of the cache's hit/miss counters
+        """
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            glyph_hits=self.glyph_hits,
+            glyph_misses=self.glyph_misses,
+            size=len(self._surfaces),
+            glyphs=len(self._glyphs),
+        )
+
+
+TEXT_CACHE = TextCache()
+
+
 class Renderable(object):
     """
     An object that knows how to render itself onto a surface, given the
-    surface's position
+    surface's position.
+
+    `ident` is a name that stays the same from frame to frame for the "same"
+    object (e.g. the ball), which is what lets us send only what changed.
     """
 
     position = None
+    ident = None
 
-    def __init__(self, pos):
+    def __init__(self, pos, ident=None):
         self.position = pos
+        self.ident = ident
+
+    def moved(self, pos):
+        """
+        :param pos: A two-element tuple of a new position
+        :return:    A copy of this renderable at `pos`
+        """
+        out = copy.copy(self)
+        out.position = pos
+
+        return out
+
+    # Python 2 doesn't derive `!=` from `__eq__`
+    def __ne__(self, other):
+        return not self == other
+
+    def bounds(self):
+        """
+        The area of the screen this object may draw to. This is used by the
+        parent process to work out which windows need to be sent this object
+        at all, so it must be computable without `pygame` being initialised.
+        It's fine for this to be an overestimate, but never an underestimate.
+
+        :return: A rectangle tuple of (x, y, width, height)
+        """
+        raise NotImplementedError()
 
     def render(self, surface, offset):
+        """
+        Draw this object onto a surface
+
+        :param surface: The `pygame.Surface` to draw to
+        :param offset:  A two-element tuple of the surface's position on the
+                        screen
+        :return:        The `pygame.Rect` of the surface that was drawn to, or
+                        `None` if nothing was drawn
+        """
         raise NotImplementedError()
 
 
 class Circle(Renderable):
     radius = None
 
-    def __init__(self, pos, radius):
-        super(Circle, self).__init__(pos)
+    def __init__(self, pos, radius, ident=None):
+        super(Circle, self).__init__(pos, ident)
         self.radius = radius
 
     def __eq__(self, other):
@@ -47,8 +222,18 @@ class Circle(Renderable):
             self.position == other.position
         )
 
+    def bounds(self):
+        return (
+            self.position[0] - self.radius,
+            self.position[1] - self.radius,
+            self.radius * 2,
+            self.radius * 2,
+        )
+
     def render(self, surface, offset):
-        pygame.draw.circle(
+        import pygame
+
+        return pygame.draw.circle(
             surface,
             WHITE,
             (
@@ -62,8 +247,8 @@ class Circle(Renderable):
 class Rectangle(Renderable):
     size = None
 
-    def __init__(self, pos, size):
-        super(Rectangle, self).__init__(pos)
+    def __init__(self, pos, size, ident=None):
+        super(Rectangle, self).__init__(pos, ident)
         self.size = size
 
     def __eq__(self, other):
@@ -72,8 +257,18 @@ class Rectangle(Renderable):
             self.position == other.position
         )
 
+    def bounds(self):
+        return (
+            self.position[0],
+            self.position[1],
+            self.size[0],
+            self.size[1],
+        )
+
     def render(self, surface, offset):
-        pygame.draw.rect(
+        import pygame
+
+        return pygame.draw.rect(
             surface,
             WHITE,
             (
@@ -88,33 +283,44 @@ class Rectangle(Renderable):
 class Text(Renderable):
     text = None
 
-    def __init__(self, pos, text):
-        super(Text, self).__init__(pos)
+    def __init__(self, pos, text, ident=None):
+        super(Text, self).__init__(pos, ident)
         self.text = str(text)
 
     def __eq__(self, other):
-        return isinstance(other, Rectangle) and (
+        return isinstance(other, Text) and (
             self.text == other.text and
             self.position == other.position
         )
 
+    def bounds(self):
+        # We can't ask the font how big the text is without initialising
+        # `pygame.font`, but no monospace glyph is wider than the font size
+        # so this is a safe overestimate (see `TEXT_HEIGHT` too).
+        return (
+            self.position[0],
+            self.position[1],
+            len(self.text) * DEFAULT_FONT_SIZE,
+            TEXT_HEIGHT,
+        )
+
     def render(self, surface, offset):
-        if (self.position[1] - offset[1]) + DEFAULT_FONT_SIZE < 0:
-            return
+        if (self.position[1] - offset[1]) + TEXT_HEIGHT < 0:
+            return None
 
         # NOTE: We do this in render because it's cheaper to send across a
         #       string and render on each window than to render server-side
         #       and send across the image (I'm actually not even sure if the
         #       image returned by this is serialisable anyway, the only way to
-        #       know is to check). We don't need to worry about the cost of
-        #       doing this every call to `render` because for this program,
-        #       `render` is only called once per instance of this object.
-        text_img = default_font().render(
+        #       know is to check). A new `Text` is built every frame, so the
+        #       rasterized text is cached by content rather than per instance.
+        text_img = TEXT_CACHE.render(
+            default_font(),
+            (DEFAULT_FONT_NAME, DEFAULT_FONT_SIZE),
             self.text,
-            True,
-            WHITE
+            WHITE,
         )
-        surface.blit(
+        return surface.blit(
             text_img,
             (
                 int(self.position[0] - offset[0]),
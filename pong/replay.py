@@ -0,0 +1,162 @@
+"""
+Replays a game recorded with `python -m pong -c <path>`, as fast as it can
+and without opening any windows. Run with `python -m pong.replay <path>`, use
+`--help` for the options.
+
+Every game in the recording is played again from the recorded frame lengths
+and window states, and checked against what the recording says happened.
+The results (including how long each game took to replay) are written as
+JSON, and `-t` prints the per-stage frame timings like the game does, so a
+recording of a slow session can be used as a benchmark.
+"""
+
+import os
+
+# This has to happen before anything imports `pong.windowing`
+os.environ.setdefault('PONG_HEADLESS', '1')
+
+import getopt
+import json
+import sys
+import timeit
+
+from itertools import repeat
+
+from . import recording, wire
+from .__main__ import (
+    options,
+    WindowPool,
+    run_game,
+    window_layout,
+    paddle_window_size,
+)
+
+timer = timeit.default_timer
+
+
+def null_window_pool(options):
+    """
+    Make a pool of windows that don't exist, laid out like `mk_window_pool`
+    would
+
+    :param options: An `Options` object, with `display_size` set
+    :return:        A `WindowPool` of `recording.NullWindow`s
+    """
+    layout = window_layout(
+        options.display_size,
+        paddle_window_size(options.display_size, options),
+        options=options,
+    )
+
+    return WindowPool(
+        chans=[recording.NullWindow(encode=wire.encode) for _ in layout],
+        procs=[],
+        layout=layout,
+        infos=list(repeat(None, len(layout))),
+    )
+
+
+def run(path, stats_interval=None):
+    """
+    Replay every game in a recording
+
+    :param path:           The path of the recording
+    :param stats_interval: The `stats_interval` option to replay with
+    :return:               A JSON-serialisable dictionary of results
+    """
+    session = recording.Recording(path)
+
+    # Options added since the recording was made keep their defaults
+    recorded_options = options(**session.options)._replace(
+        stats_interval=stats_interval,
+    )
+    pool = null_window_pool(recorded_options)
+
+    results = []
+
+    for game in session.games():
+        start = timer()
+        score = run_game(
+            game.last_score,
+            game.highscore,
+            recorded_options,
+            pool=pool,
+            replay=game,
+        )
+        elapsed = timer() - start
+
+        results.append(
+            dict(
+                score=score,
+                ticks=game.ticks,
+                diverged=game.diverged,
+                first_divergence=game.first_divergence,
+                seconds=elapsed,
+                ticks_per_second=game.ticks / elapsed if elapsed else None,
+            )
+        )
+
+    session.close()
+
+    return dict(
+        recording=path,
+        games=results,
+    )
+
+
+if __name__ == '__main__':
+    usage = (
+        'Usage: python -m pong.replay [options] <recording>...\n'
+        'Possible options:\n'
+        '    -t, --stats\n'
+        '        Print the per-stage frame timings every this many seconds '
+        'and\n'
+        '        when each game ends (0 for only when each game ends)\n'
+        '    -o, --output\n'
+        '        Write the JSON results here instead of stdout\n'
+        '    -h, --help\n'
+        '        Show this message'
+    )
+
+    try:
+        opts, paths = getopt.getopt(
+            sys.argv[1:],
+            't:o:h',
+            ['stats=', 'output=', 'help'],
+        )
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    stats_interval = None
+    output = None
+
+    for name, val in opts:
+        if name in ('-t', '--stats'):
+            stats_interval = float(val)
+        elif name in ('-o', '--output'):
+            output = val
+        else:
+            print(usage)
+            sys.exit(0)
+
+    if not paths:
+        print(usage)
+        sys.exit(2)
+
+    results = [run(path, stats_interval) for path in paths]
+
+    if output is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print('')
+    else:
+        with open(output, 'w') as out_file:
+            json.dump(results, out_file, indent=2, sort_keys=True)
+
+    # Like a failing test, so scripts can tell a replay went differently
+    if any(
+        game['diverged']
+        for result in results
+        for game in result['games']
+    ):
+        sys.exit(1)
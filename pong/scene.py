@@ -0,0 +1,129 @@
+"""
+Retained-mode scenes. A scene is a dictionary of `Renderable.ident` to
+`Renderable`, which lets the parent send each window only what changed since
+the last frame instead of everything, every frame.
+"""
+
+from . import messages
+
+
+def from_renderables(renderables):
+    """
+    Build a scene from a list of `Renderable`s. Every renderable must have a
+    unique `ident`.
+
+    :param renderables: A list of `Renderable`s
+    :return:            A scene dictionary
+    """
+    return dict((renderable.ident, renderable) for renderable in renderables)
+
+
+def diff(old, new):
+    """
+    Work out the `render` message that turns one scene into another.
+
+    :param old: The scene the receiver currently has, or `None` if the receiver
+                has no scene at all (or we can't trust what it has)
+    :param new: The scene the receiver should end up with
+    :return:    A `render` message, or `None` if the scenes are the same
+    """
+    if old is None:
+        return messages.render(list(new.values()), reset=True)
+
+    changed = [
+        renderable
+        for ident, renderable in new.items()
+        if old.get(ident) != renderable
+    ]
+    removed = [ident for ident in old if ident not in new]
+
+    if changed or removed:
+        return messages.render(changed, removed)
+    else:
+        return None
+
+
+def apply(scene, delta):
+    """
+    Apply the contents of a `render` message to a scene
+
+    :param scene: A scene dictionary
+    :param delta: The `RenderDelta` from a `render` message
+    :return:      The updated scene
+    """
+    out = {} if delta.reset else dict(scene)
+
+    for ident in delta.removed:
+        out.pop(ident, None)
+
+    out.update(from_renderables(delta.changed))
+
+    return out
+
+
+def interpolate(old, new, alpha):
+    """
+    Blend the positions of everything that moved between two scenes. Only
+    renderables that are in both scenes and didn't change apart from moving
+    are blended, everything else is taken as it is in `new`.
+
+    :param old:   The earlier scene
+    :param new:   The later scene
+    :param alpha: How far to go from `old` to `new`, where 0 is `old` and 1
+                  is `new`. Anything above 1 extrapolates past `new`
+    :return:      A scene dictionary
+    """
+    out = dict(new)
+
+    for ident, renderable in new.items():
+        before = old.get(ident)
+
+        if (
+            before is None or
+            before.position == renderable.position or
+            before.moved(renderable.position) != renderable
+        ):
+            continue
+
+        out[ident] = renderable.moved(
+            (
+                before.position[0] +
+                (renderable.position[0] - before.position[0]) * alpha,
+                before.position[1] +
+                (renderable.position[1] - before.position[1]) * alpha,
+            )
+        )
+
+    return out
+
+
+def follow(scene, ball, followers, position):
+    """
+    Move a ball to a position, and some other renderables up or down with it
+
+    :param scene:     A scene dictionary
+    :param ball:      The ident of the ball
+    :param followers: The idents of the renderables that keep the same
+                      vertical distance from the ball
+    :param position:  A two-element tuple of the ball's new position
+    :return:          The updated scene, which is `scene` itself if the ball
+                      isn't in it
+    """
+    before = scene.get(ball)
+
+    if before is None:
+        return scene
+
+    out = dict(scene)
+    out[ball] = before.moved(position)
+    dy = position[1] - before.position[1]
+
+    for ident in followers:
+        follower = scene.get(ident)
+
+        if follower is not None:
+            out[ident] = follower.moved(
+                (follower.position[0], follower.position[1] + dy),
+            )
+
+    return out
@@ -0,0 +1,128 @@
+"""
+Closed-form ball movement. Rather than moving the ball a little every tick
+and checking whether it went past an edge, a `Trajectory` works out when the
+ball will next hit a paddle and where it is at any time before then.
+
+Bounces off the top and bottom don't change the ball's speed, so they're
+folded into the position calculation: the ball is moved along a straight line
+and the y coordinate is reflected back into the play area. Bounces off the
+paddles do (since they score), so each one starts a new `Trajectory`.
+
+This means the ball can't tunnel through an edge however fast it goes, and
+working out where it is after a long stall costs the same as after a frame.
+"""
+
+
+def fold(offset, length):
+    """
+    Reflect a distance travelled along a line back and forth into a range, as
+    if it bounced off both ends
+
+    :param offset: The distance from the start of the range, unbounded
+    :param length: The length of the range
+    :return:       A tuple of (distance from the start of the range, 1 if
+                   moving away from the start or -1 if moving towards it)
+    """
+    if length <= 0:
+        return 0, 1
+
+    offset %= 2 * length
+
+    if offset <= length:
+        return offset, 1
+    else:
+        return 2 * length - offset, -1
+
+
+class Trajectory(object):
+    """
+    The path of the ball from one paddle bounce to the next.
+
+    :param position:  A two-element tuple of the ball's position at `start`
+    :param direction: A two-element tuple of the ball's direction, like
+                      `handle_ball_physics` uses
+    :param speed:     The ball's speed
+    :param play_area: A rectangle tuple of (x, y, width, height) that the
+                      ball's center stays in
+    :param start:     The time the trajectory starts, in seconds
+    """
+
+    position = None
+    direction = None
+    speed = None
+    play_area = None
+    start = None
+    bounce_time = None
+
+    def __init__(self, position, direction, speed, play_area, start=0.0):
+        area_x, area_y, area_w, area_h = play_area
+
+        # Anything outside of the play area would bounce straight away anyway
+        self.position = (
+            min(max(position[0], area_x), area_x + area_w),
+            min(max(position[1], area_y), area_y + area_h),
+        )
+        self.direction = tuple(direction)
+        self.speed = speed
+        self.play_area = tuple(play_area)
+        self.start = start
+
+        x_speed = speed * direction[0]
+
+        if x_speed > 0:
+            self.bounce_time = (
+                start + (area_x + area_w - self.position[0]) / float(x_speed)
+            )
+        elif x_speed < 0:
+            self.bounce_time = (
+                start + (area_x - self.position[0]) / float(x_speed)
+            )
+        else:
+            self.bounce_time = float('inf')
+
+    def _at(self, time):
+        elapsed = min(max(time - self.start, 0), self.bounce_time - self.start)
+        area_x, area_y, area_w, area_h = self.play_area
+
+        x = self.position[0] + self.speed * self.direction[0] * elapsed
+        y_offset, y_sign = fold(
+            self.position[1] - area_y +
+            self.speed * self.direction[1] * elapsed,
+            area_h,
+        )
+
+        return (x, area_y + y_offset), y_sign
+
+    def position_at(self, time):
+        """
+        :param time: A time between `start` and `bounce_time`, anything outside
+                     of that is clamped to it
+        :return:     A two-element tuple of the ball's position
+        """
+        return self._at(time)[0]
+
+    def direction_at(self, time):
+        """
+        :param time: A time between `start` and `bounce_time`
+        :return:     A two-element tuple of the ball's direction
+        """
+        y_sign = self._at(time)[1]
+
+        return self.direction[0], self.direction[1] * y_sign
+
+    def bounce(self, speed):
+        """
+        Bounce the ball off the paddle it hits at `bounce_time`
+
+        :param speed: The ball's speed after the bounce
+        :return:      A new `Trajectory` starting at `bounce_time`
+        """
+        x_dir, y_dir = self.direction_at(self.bounce_time)
+
+        return Trajectory(
+            position=self.position_at(self.bounce_time),
+            direction=(-x_dir, y_dir),
+            speed=speed,
+            play_area=self.play_area,
+            start=self.bounce_time,
+        )
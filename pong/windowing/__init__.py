@@ -16,10 +16,45 @@ WindowInfo = namedtuple(
 def is_windows():
     return os.name == 'nt'
 
+
+def is_headless():
+    """
+    Whether we're running without a display, see `pong.windowing.headless`
+    """
+    return os.environ.get('PONG_HEADLESS', '') not in ('', '0')
+
+
 # NOTE: We assume that handle is a HWND on Windows, and an X11 Xid otherwise
 #       (sorry, Wayland). This means that this code will probably not work on
 #       macOS, although I haven't tried it.
-if is_windows():
-    from .windows import get_win_info, set_translation
+if is_headless():
+    # This has to be set before `pygame.display` is initialised, and setting
+    # it here means child processes inherit it too
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+    from .headless import (
+        display_size,
+        get_win_info,
+        set_translation,
+        pin_window,
+        unpin_window,
+        enforce_pin,
+    )
+elif is_windows():
+    from .windows import (
+        display_size,
+        get_win_info,
+        set_translation,
+        pin_window,
+        unpin_window,
+        enforce_pin,
+    )
 else:
-    from .linux import get_win_info, set_translation
+    from .linux import (
+        display_size,
+        get_win_info,
+        set_translation,
+        pin_window,
+        unpin_window,
+        enforce_pin,
+    )
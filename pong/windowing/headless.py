@@ -0,0 +1,176 @@
+"""
+An in-memory windowing implementation, for running the game without a
+display (e.g. on a CI box). Use it by setting `PONG_HEADLESS=1`, which also
+makes SDL use its dummy video driver.
+
+Each process only knows about its own windows, there's no window manager to
+move them around. Instead, windows can be scripted by setting
+`PONG_HEADLESS_SCRIPT` to a `module:function` path. The function is called as
+`function(handle, info, seconds since the window was created)` every time a
+window's geometry is queried, and returns a new `(x, y)` position or `None` to
+leave the window where it is.
+"""
+
+import importlib
+import math
+import os
+import time
+
+from . import WindowInfo
+
+DEFAULT_DISPLAY_SIZE = 1920, 1080
+
+WINDOWS = {}
+CREATED = {}
+ORIGINS = {}
+PINS = {}
+SCRIPT = None
+NEXT_HANDLE = 1
+
+
+def display_size():
+    """
+    The size of the pretend display, from `PONG_HEADLESS_DISPLAY_SIZE` (as
+    `width,height`) if set
+
+    :return: An integer tuple of (width, height)
+    """
+    size = os.environ.get('PONG_HEADLESS_DISPLAY_SIZE')
+
+    if size is None:
+        return DEFAULT_DISPLAY_SIZE
+
+    width, height = map(int, size.split(','))
+    return width, height
+
+
+def tile_positions(display_size, window_size, count):
+    """
+    Positions for `count` windows so that, given enough of them, every point on
+    the display is covered. The last row and column are pushed against the
+    edges of the display, so neighbouring windows overlap slightly instead of
+    leaving a gap. Once every cell is used the positions wrap around.
+
+    :param display_size: An integer tuple of (display width, display height)
+    :param window_size:  An integer tuple of (window width, window height)
+    :param count:        The number of positions
+    :return:             A list of integer tuples of (x, y)
+    """
+    def spread(total, size):
+        cells = max(int(math.ceil(float(total) / size)), 1)
+
+        if cells == 1:
+            return [0]
+
+        step = float(total - size) / (cells - 1)
+        return [int(round(i * step)) for i in range(cells)]
+
+    cells = [
+        (x, y)
+        for y in spread(display_size[1], window_size[1])
+        for x in spread(display_size[0], window_size[0])
+    ]
+
+    return [cells[i % len(cells)] for i in range(count)]
+
+
+def script():
+    global SCRIPT
+
+    if SCRIPT is None:
+        path = os.environ.get('PONG_HEADLESS_SCRIPT')
+
+        if path is None:
+            SCRIPT = still
+        else:
+            module, function = path.split(':')
+            SCRIPT = getattr(importlib.import_module(module), function)
+
+    return SCRIPT
+
+
+def still(handle, info, elapsed):
+    """
+    The default script, which never moves anything
+    """
+    return None
+
+
+def wobble(handle, info, elapsed):
+    """
+    A script that moves every unpinned window back and forth by a few pixels
+    either side of where it was created, which is handy for exercising the
+    full-redraw path
+    """
+    if handle in PINS:
+        return None
+
+    x, y = ORIGINS[handle]
+
+    return x + int(round(math.sin(elapsed * 4) * 2)), y
+
+
+def create_window(size, position=None):
+    """
+    Make a new pretend window
+
+    :param size:     An integer tuple of (width, height)
+    :param position: An integer tuple of (x, y), or `None` to put it in the
+                     middle of the display
+    :return:         The new window's handle
+    """
+    global NEXT_HANDLE
+
+    if position is None:
+        display_width, display_height = display_size()
+        position = (
+            (display_width - size[0]) // 2,
+            (display_height - size[1]) // 2,
+        )
+
+    handle = NEXT_HANDLE
+    NEXT_HANDLE += 1
+
+    WINDOWS[handle] = WindowInfo(
+        x=position[0],
+        y=position[1],
+        width=size[0],
+        height=size[1],
+    )
+    CREATED[handle] = time.time()
+    ORIGINS[handle] = tuple(position)
+
+    return handle
+
+
+def get_win_info(handle):
+    info = WINDOWS[handle]
+    position = script()(handle, info, time.time() - CREATED[handle])
+
+    if position is not None:
+        set_translation(handle, position)
+
+    return WINDOWS[handle]
+
+
+def set_translation(handle, pos):
+    WINDOWS[handle] = WINDOWS[handle]._replace(x=pos[0], y=pos[1])
+
+
+def pin_window(handle, pos=None, fixed=False):
+    if pos is None:
+        info = WINDOWS[handle]
+        pos = info.x, info.y
+
+    PINS[handle] = tuple(pos)
+
+
+def unpin_window(handle):
+    PINS.pop(handle, None)
+
+
+def enforce_pin(handle):
+    pos = PINS.get(handle)
+
+    if pos is not None and (WINDOWS[handle].x, WINDOWS[handle].y) != pos:
+        set_translation(handle, pos)
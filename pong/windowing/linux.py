@@ -1,10 +1,21 @@
 import Xlib
 
+from Xlib import X, Xutil
 from Xlib.display import Display
 
 from . import WindowInfo
+from .. import clock
 
 DEFAULT_DISPLAY = None
+TRACKERS = {}
+
+# How long to wait for the window manager to move a frame before deciding it
+# ignored the request, in seconds (see `GeometryTracker.drifted`)
+MOVE_TIMEOUT = 0.25
+
+# Functions that `pump_events` hands every event to as well as the trackers,
+# for windows that are drawn by this process (see `pong.xrender`)
+LISTENERS = []
 
 
 def display():
@@ -16,36 +27,310 @@ def display():
     return DEFAULT_DISPLAY
 
 
-def get_win_info(handle):
-    win = display().create_resource_object('window', handle)
-    geometry = win.get_geometry()
-    geo = win.query_tree().parent.query_tree().parent.get_geometry()
+class GeometryTracker(object):
+    """
+    Keeps track of a window's absolute position without asking the X server
+    every time.
+
+    A window's absolute position is the sum of its position and those of all
+    its ancestors (the window manager's frames) relative to their parents.
+    Walking that chain costs a couple of blocking round trips per level, so
+    instead we walk it once, add `StructureNotifyMask` to the events selected
+    on every window in it and then keep the cached positions up to date from
+    the `ConfigureNotify` events the server sends us whenever one of them
+    moves.
+    We only walk the chain again when one of the windows is reparented or
+    destroyed (e.g. the window manager reframing the window).
+
+    This also holds the window's pin (see `pin_window`), since checking
+    whether a pinned window has drifted is just a matter of looking at the
+    cached geometry.
+    """
+
+    handle = None
+    pin = None
+
+    def __init__(self, handle):
+        self.handle = handle
+
+        # Window ids from `handle` up to and including the root
+        self._chain = []
+        self._offsets = {}
+        self._size = None
+        self._stale = True
+        self._moving = False
+        self._move_time = None
+
+    def _rebuild(self):
+        self._chain = []
+        self._offsets = {}
+
+        cur_win = display().create_resource_object('window', self.handle)
+
+        while isinstance(cur_win, Xlib.xobject.drawable.Window):
+            # Setting the mask replaces whatever this connection had already
+            # selected on the window (e.g. `pong.xrender` selecting Expose
+            # events on its own windows), so add to it instead
+            event_mask = cur_win.get_attributes().your_event_mask
+
+            if not event_mask & X.StructureNotifyMask:
+                cur_win.change_attributes(
+                    event_mask=event_mask | X.StructureNotifyMask,
+                )
+
+            cur_geo = cur_win.get_geometry()
+            self._chain.append(cur_win.id)
+            self._offsets[cur_win.id] = cur_geo.x, cur_geo.y
+
+            if cur_win.id == self.handle:
+                self._size = cur_geo.width, cur_geo.height
+
+            cur_win = cur_win.query_tree().parent
+
+        self._stale = False
+        self._moving = False
+
+    def _refresh(self):
+        pump_events()
+
+        if self._stale:
+            self._rebuild()
+
+    def _frame_id(self):
+        # The outermost window that isn't the root, i.e. the one the window
+        # manager lets the user drag around. For an unmanaged window this is
+        # the window itself.
+        return self._chain[-2] if len(self._chain) >= 2 else self._chain[0]
+
+    def handle_event(self, event):
+        """
+        Update the cached geometry from an X event
+
+        :param event: Any event from `display()`, ones that aren't about this
+                      window's chain of ancestors are ignored
+        """
+        window = getattr(event, 'window', None)
+
+        if window is None or window.id not in self._offsets:
+            return
+
+        window_id = window.id
+
+        if event.type == X.ConfigureNotify:
+            if window_id == self._frame_id():
+                self._moving = False
+
+            # Synthetic events are sent by the window manager with coordinates
+            # relative to the root instead of the parent, so they don't fit
+            # in with the rest of the chain. There'll be a real one too.
+            if event.send_event:
+                return
+
+            self._offsets[window_id] = event.x, event.y
+
+            if window_id == self.handle:
+                self._size = event.width, event.height
+        elif event.type in (X.ReparentNotify, X.DestroyNotify):
+            self._stale = True
+
+    def win_info(self):
+        """
+        Get the window's current geometry, only making round trips to the X
+        server if the chain of ancestors changed since the last call.
+
+        :return: A `WindowInfo`
+        """
+        self._refresh()
+
+        x, y = 0, 0
+
+        for offset_x, offset_y in self._offsets.values():
+            x += offset_x
+            y += offset_y
+
+        return WindowInfo(
+            x=x,
+            y=y,
+            width=self._size[0],
+            height=self._size[1],
+        )
+
+    def frame(self):
+        """
+        :return: The `Window` that `set_translation` should move
+        """
+        self._refresh()
+
+        return display().create_resource_object('window', self._frame_id())
 
-    x, y = 0, 0
+    def frame_position(self):
+        """
+        :return: The position of `frame()`, in the same coordinates that
+                 `set_translation` takes
+        """
+        self._refresh()
 
-    cur_win = win
+        return self._offsets[self._frame_id()]
 
-    while isinstance(cur_win, Xlib.xobject.drawable.Window):
-        cur_geo = cur_win.get_geometry()
-        x += cur_geo.x
-        y += cur_geo.y
+    def move_frame(self, pos):
+        x, y = pos
 
-        cur_win = cur_win.query_tree().parent
+        self.frame().configure(x=x, y=y)
+        display().flush()
+        self._moving = True
+        self._move_time = clock.monotonic()
 
-    return WindowInfo(
-        x=x,
-        y=y,
-        width=geometry.width,
-        height=geometry.height,
-    )
+    def drifted(self):
+        """
+        :return: Whether the window is pinned, isn't where it's pinned and
+                 isn't already being moved back. Window managers sometimes
+                 ignore a move without telling us, so a move that hasn't
+                 happened after `MOVE_TIMEOUT` is given up on (and retried)
+        """
+        if (
+            self._moving and
+            clock.monotonic() - self._move_time >= MOVE_TIMEOUT
+        ):
+            self._moving = False
+
+        return (
+            self.pin is not None and
+            not self._moving and
+            tuple(self.frame_position()) != tuple(self.pin)
+        )
+
+
+def display_size():
+    """
+    The size of the primary monitor according to RandR, or of the whole screen
+    if the server doesn't support RandR or doesn't have a primary monitor.
+
+    NOTE: This uses a connection of its own rather than `display()`, since
+          it's called in the parent process before the windows' processes are
+          forked, and they mustn't inherit (and share) its connection.
+
+    :return: An integer tuple of (width, height)
+    """
+    disp = Display()
+
+    try:
+        screen = disp.screen()
+
+        if disp.has_extension('RANDR'):
+            timestamp = (
+                screen.root.xrandr_get_screen_resources().config_timestamp
+            )
+            primary = screen.root.xrandr_get_output_primary().output
+
+            if primary:
+                output = disp.xrandr_get_output_info(primary, timestamp)
+
+                if output.crtc:
+                    crtc = disp.xrandr_get_crtc_info(output.crtc, timestamp)
+
+                    return crtc.width, crtc.height
+
+        return screen.width_in_pixels, screen.height_in_pixels
+    finally:
+        disp.close()
+
+
+def pump_events():
+    """
+    Hand every event that has already arrived from the X server to the
+    trackers and `LISTENERS`, without blocking
+    """
+    disp = display()
+
+    while disp.pending_events():
+        event = disp.next_event()
+
+        for tracker in TRACKERS.values():
+            tracker.handle_event(event)
+
+        for listener in LISTENERS:
+            listener(event)
+
+
+def tracker(handle):
+    """
+    Get the `GeometryTracker` for a window, creating it if necessary
+    """
+    if handle not in TRACKERS:
+        TRACKERS[handle] = GeometryTracker(handle)
+
+    return TRACKERS[handle]
+
+
+def get_win_info(handle):
+    return tracker(handle).win_info()
 
 
 def set_translation(handle, pos):
-    win = display().create_resource_object('window', handle)
+    tracker(handle).move_frame(pos)
+
+
+def pin_window(handle, pos=None, fixed=False):
+    """
+    Keep a window at a position. This doesn't move it there by itself, call
+    `enforce_pin` every so often to do that.
+
+    :param handle: The window's X11 Xid
+    :param pos:    The position to keep the window at (in `set_translation`
+                   coordinates), or `None` to keep it where it is now
+    :param fixed:  If `True`, tell the window manager not to let the user move
+                   or resize the window at all. This is done by setting the
+                   window's size/position hints and then remapping it as an
+                   override-redirect window, so it's only really suitable for
+                   windows that are pinned for their whole lifetime.
+    """
+    pin_tracker = tracker(handle)
+
+    if pos is None:
+        pos = pin_tracker.frame_position()
+
+    pin_tracker.pin = tuple(pos)
+
+    if fixed:
+        win = display().create_resource_object('window', handle)
+        info = pin_tracker.win_info()
+
+        win.set_wm_normal_hints(
+            flags=(
+                Xutil.USPosition |
+                Xutil.PPosition |
+                Xutil.PMinSize |
+                Xutil.PMaxSize
+            ),
+            x=pos[0],
+            y=pos[1],
+            min_width=info.width,
+            min_height=info.height,
+            max_width=info.width,
+            max_height=info.height,
+        )
+
+        # Override-redirect only takes effect when the window is mapped, so we
+        # have to unmap it first. The window manager will unframe it, which
+        # the tracker notices from the `ReparentNotify`, and the next
+        # `enforce_pin` moves it back into place.
+        win.unmap()
+        win.change_attributes(override_redirect=True)
+        win.map()
+        display().flush()
+
+
+def unpin_window(handle):
+    tracker(handle).pin = None
+
 
-    x, y = pos
+def enforce_pin(handle):
+    """
+    Move a pinned window back to its pin, but only if the cached geometry says
+    it has drifted away from it. When it hasn't this doesn't talk to the X
+    server at all.
+    """
+    pin_tracker = tracker(handle)
 
-    win.query_tree().parent.query_tree().parent.configure(
-        x=x,
-        y=y,
-    )
+    if pin_tracker.drifted():
+        pin_tracker.move_frame(pin_tracker.pin)
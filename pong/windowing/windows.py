@@ -2,6 +2,11 @@ import ctypes
 
 from . import WindowInfo
 
+PINS = {}
+
+SM_CXSCREEN = 0
+SM_CYSCREEN = 1
+
 
 class get_wnd_rect(ctypes.Structure):
     _fields_ = [
@@ -12,6 +17,16 @@ class get_wnd_rect(ctypes.Structure):
     ]
 
 
+def display_size():
+    """
+    :return: An integer tuple of the primary monitor's (width, height)
+    """
+    return (
+        int(ctypes.windll.user32.GetSystemMetrics(SM_CXSCREEN)),
+        int(ctypes.windll.user32.GetSystemMetrics(SM_CYSCREEN)),
+    )
+
+
 def get_win_info(handle):
     out_rect = get_wnd_rect()
     ctypes.windll.user32.GetWindowRect(handle, ctypes.byref(out_rect))
@@ -40,3 +55,36 @@ def set_translation(handle, pos):
     # https://msdn.microsoft.com/en-us/library/ms633534(VS.85).aspx
     if err == ctypes.c_bool(0):
         raise ctypes.WinError()
+
+
+def pin_window(handle, pos=None, fixed=False):
+    """
+    Keep a window at a position, see `enforce_pin`. `fixed` is accepted for
+    compatibility with the X11 implementation but does nothing here.
+    """
+    if pos is None:
+        current = get_win_info(handle)
+        pos = current.x, current.y
+
+    PINS[handle] = tuple(pos)
+
+
+def unpin_window(handle):
+    PINS.pop(handle, None)
+
+
+def enforce_pin(handle):
+    """
+    Move a pinned window back to its pin if it has drifted away from it.
+    `GetWindowRect` doesn't need to talk to another process, so this is cheap
+    when the window hasn't moved.
+    """
+    pos = PINS.get(handle)
+
+    if pos is None:
+        return
+
+    current = get_win_info(handle)
+
+    if (current.x, current.y) != pos:
+        set_translation(handle, pos)
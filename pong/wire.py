@@ -0,0 +1,332 @@
+"""
+A compact binary encoding for everything that gets sent over a
+`pong.channel`, used instead of pickling `Message` namedtuples and
+`Renderable` instances every frame.
+
+Everything is little-endian. A payload is laid out as:
+
+    payload      := u8 is_list, [u16 count], message...
+    message      := u8 type, body
+    client_state := i32 x, i32 y, u32 width, u32 height
+    reset        := u8 has_position, i32 x, i32 y
+    timestamp    := f64 seconds
+    predict      := f64 start, f32 x, f32 y, f32 dx, f32 dy, f32 speed,
+                    f32 area x, f32 area y, f32 area width, f32 area height,
+                    u8 followers, ident ball, ident...
+    render       := u8 reset, u16 circles, u16 rectangles, u16 texts,
+                    u16 removed, circle..., rectangle..., text..., ident...,
+                    text bytes...
+    circle       := ident, f32 x, f32 y, u16 radius
+    rectangle    := ident, f32 x, f32 y, u16 width, u16 height
+    text         := ident, f32 x, f32 y, u16 length
+    ident        := 16 bytes, NUL-padded
+
+Every record of a given kind has the same layout, so each kind is packed and
+unpacked with a single `struct` call no matter how many of them there are.
+The text records only hold lengths, the strings themselves come at the very
+end so they don't break up the fixed-size records.
+"""
+
+import struct
+
+from itertools import chain
+
+from . import messages, render
+from .windowing import WindowInfo
+
+IDENT_SIZE = 16
+
+CIRCLE_RECORD = '{}sffH'.format(IDENT_SIZE)
+RECTANGLE_RECORD = '{}sffHH'.format(IDENT_SIZE)
+TEXT_RECORD = '{}sffH'.format(IDENT_SIZE)
+IDENT_RECORD = '{}s'.format(IDENT_SIZE)
+
+_BYTE = struct.Struct('<B')
+_COUNT = struct.Struct('<H')
+_CLIENT_STATE = struct.Struct('<iiII')
+_RESET = struct.Struct('<Bii')
+_TIMESTAMP = struct.Struct('<d')
+_PREDICT = struct.Struct('<d9fB')
+_RENDER_HEADER = struct.Struct('<BHHHH')
+
+_BATCH_STRUCTS = {}
+
+
+def _batch_struct(record, count):
+    """
+    Get a (cached) `struct.Struct` for `count` back-to-back records.
+
+    :param record: The `struct` format of a single record, without byte order
+    :param count:  The number of records
+    :return:       A `struct.Struct`
+    """
+    key = record, count
+
+    if key not in _BATCH_STRUCTS:
+        _BATCH_STRUCTS[key] = struct.Struct('<' + record * count)
+
+    return _BATCH_STRUCTS[key]
+
+
+def _chunks(values, size):
+    """
+    Split a flat tuple of unpacked values back into per-record tuples
+    """
+    return zip(*[iter(values)] * size)
+
+
+def _encode_ident(ident):
+    out = ident.encode('ascii')
+
+    if len(out) > IDENT_SIZE:
+        raise ValueError(
+            'Ident {!r} is longer than {} bytes'.format(ident, IDENT_SIZE)
+        )
+
+    return out
+
+
+# The same handful of idents come through every frame, so it's worth skipping
+# the strip and decode for them
+_DECODED_IDENTS = {}
+
+
+def _decode_ident(data):
+    if data not in _DECODED_IDENTS:
+        _DECODED_IDENTS[data] = data.rstrip(b'\0').decode('ascii')
+
+    return _DECODED_IDENTS[data]
+
+
+def _encode_render(delta):
+    circles = []
+    rectangles = []
+    texts = []
+
+    for renderable in delta.changed:
+        if isinstance(renderable, render.Circle):
+            circles.append(renderable)
+        elif isinstance(renderable, render.Rectangle):
+            rectangles.append(renderable)
+        elif isinstance(renderable, render.Text):
+            texts.append(renderable)
+        else:
+            raise TypeError('Cannot encode {!r}'.format(renderable))
+
+    text_bytes = [text.text.encode('utf-8') for text in texts]
+
+    return b''.join(
+        [
+            _RENDER_HEADER.pack(
+                bool(delta.reset),
+                len(circles),
+                len(rectangles),
+                len(texts),
+                len(delta.removed),
+            ),
+            _batch_struct(CIRCLE_RECORD, len(circles)).pack(
+                *chain.from_iterable(
+                    (
+                        _encode_ident(c.ident),
+                        c.position[0],
+                        c.position[1],
+                        c.radius,
+                    )
+                    for c in circles
+                )
+            ),
+            _batch_struct(RECTANGLE_RECORD, len(rectangles)).pack(
+                *chain.from_iterable(
+                    (
+                        _encode_ident(r.ident),
+                        r.position[0],
+                        r.position[1],
+                        r.size[0],
+                        r.size[1],
+                    )
+                    for r in rectangles
+                )
+            ),
+            _batch_struct(TEXT_RECORD, len(texts)).pack(
+                *chain.from_iterable(
+                    (
+                        _encode_ident(t.ident),
+                        t.position[0],
+                        t.position[1],
+                        len(data),
+                    )
+                    for t, data in zip(texts, text_bytes)
+                )
+            ),
+            _batch_struct(IDENT_RECORD, len(delta.removed)).pack(
+                *map(_encode_ident, delta.removed)
+            ),
+        ] + text_bytes
+    )
+
+
+def _decode_render(data, offset):
+    reset, n_circles, n_rectangles, n_texts, n_removed = (
+        _RENDER_HEADER.unpack_from(data, offset)
+    )
+    offset += _RENDER_HEADER.size
+
+    batches = []
+
+    for record, count in (
+        (CIRCLE_RECORD, n_circles),
+        (RECTANGLE_RECORD, n_rectangles),
+        (TEXT_RECORD, n_texts),
+        (IDENT_RECORD, n_removed),
+    ):
+        batch = _batch_struct(record, count)
+        batches.append(batch.unpack_from(data, offset))
+        offset += batch.size
+
+    circle_values, rectangle_values, text_values, removed_values = batches
+
+    changed = [
+        render.Circle((x, y), radius, ident=_decode_ident(ident))
+        for ident, x, y, radius in _chunks(circle_values, 4)
+    ]
+
+    changed.extend(
+        render.Rectangle((x, y), (w, h), ident=_decode_ident(ident))
+        for ident, x, y, w, h in _chunks(rectangle_values, 5)
+    )
+
+    for ident, x, y, length in _chunks(text_values, 4):
+        text = data[offset:offset + length].decode('utf-8')
+        offset += length
+
+        changed.append(render.Text((x, y), text, ident=_decode_ident(ident)))
+
+    info = messages.RenderDelta(
+        reset=bool(reset),
+        changed=changed,
+        removed=list(map(_decode_ident, removed_values)),
+    )
+
+    return info, offset
+
+
+def _encode_predict(prediction):
+    return _PREDICT.pack(
+        prediction.start,
+        *chain(
+            prediction.position,
+            prediction.direction,
+            [prediction.speed],
+            prediction.play_area,
+            [len(prediction.followers)],
+        )
+    ) + _batch_struct(IDENT_RECORD, 1 + len(prediction.followers)).pack(
+        *map(_encode_ident, chain([prediction.ball], prediction.followers))
+    )
+
+
+def _decode_predict(data, offset):
+    values = _PREDICT.unpack_from(data, offset)
+    offset += _PREDICT.size
+
+    batch = _batch_struct(IDENT_RECORD, 1 + values[10])
+    idents = list(map(_decode_ident, batch.unpack_from(data, offset)))
+    offset += batch.size
+
+    info = messages.Prediction(
+        start=values[0],
+        position=values[1:3],
+        direction=values[3:5],
+        speed=values[5],
+        play_area=values[6:10],
+        ball=idents[0],
+        followers=idents[1:],
+    )
+
+    return info, offset
+
+
+def _encode_message(msg):
+    header = _BYTE.pack(msg.type)
+
+    if msg.type == messages.RENDER:
+        return header + _encode_render(msg.info)
+    elif msg.type == messages.CLIENT_STATE:
+        return header + _CLIENT_STATE.pack(*msg.info)
+    elif msg.type == messages.RESET:
+        x, y = msg.info if msg.info is not None else (0, 0)
+        return header + _RESET.pack(msg.info is not None, x, y)
+    elif msg.type == messages.TIMESTAMP:
+        return header + _TIMESTAMP.pack(msg.info)
+    elif msg.type == messages.PREDICT:
+        return header + _encode_predict(msg.info)
+    elif msg.info is None:
+        return header
+    else:
+        raise TypeError('Cannot encode {!r}'.format(msg))
+
+
+def _decode_message(data, offset):
+    msg_type, = _BYTE.unpack_from(data, offset)
+    offset += _BYTE.size
+
+    if msg_type == messages.RENDER:
+        info, offset = _decode_render(data, offset)
+    elif msg_type == messages.CLIENT_STATE:
+        info = WindowInfo(*_CLIENT_STATE.unpack_from(data, offset))
+        offset += _CLIENT_STATE.size
+    elif msg_type == messages.RESET:
+        has_position, x, y = _RESET.unpack_from(data, offset)
+        info = (x, y) if has_position else None
+        offset += _RESET.size
+    elif msg_type == messages.TIMESTAMP:
+        info, = _TIMESTAMP.unpack_from(data, offset)
+        offset += _TIMESTAMP.size
+    elif msg_type == messages.PREDICT:
+        info, offset = _decode_predict(data, offset)
+    else:
+        info = None
+
+    return messages.Message(type=msg_type, info=info), offset
+
+
+def encode(obj):
+    """
+    Encode a `Message`, or a list of them, to bytes
+
+    :param obj: A `Message` or a list of `Message`s
+    :return:    A byte string
+    """
+    if isinstance(obj, messages.Message):
+        return _BYTE.pack(False) + _encode_message(obj)
+    else:
+        return b''.join(
+            chain(
+                [_BYTE.pack(True), _COUNT.pack(len(obj))],
+                map(_encode_message, obj),
+            )
+        )
+
+
+def decode(data):
+    """
+    The inverse of `encode`
+
+    :param data: A byte string
+    :return:     A `Message` or a list of `Message`s
+    """
+    is_list, = _BYTE.unpack_from(data, 0)
+
+    if not is_list:
+        msg, _ = _decode_message(data, _BYTE.size)
+        return msg
+
+    count, = _COUNT.unpack_from(data, _BYTE.size)
+    offset = _BYTE.size + _COUNT.size
+    out = []
+
+    for _ in range(count):
+        msg, offset = _decode_message(data, offset)
+        out.append(msg)
+
+    return out
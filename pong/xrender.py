@@ -0,0 +1,382 @@
+"""
+Draws every game window from the game's own process, straight through Xlib.
+
+Normally each window is a `GameProcess` of its own, since pygame only lets a
+process have one display surface. That's a Python interpreter, a pygame and an
+X connection per window, plus encoding every frame to send it across. Here
+each window is an `XWindow` instead, which has the same methods as the
+`pong.channel.Channel` the game would use to talk to a `GameProcess`, so the
+game loop doesn't know the difference: sending a window a frame just draws
+it, and the window's state is read straight from its `GeometryTracker`.
+
+Every window shares one X connection, so waiting for any of them to have
+something to say is waiting on that connection (see `pong.channel.wait`).
+
+Each window draws into a pixmap on the X server and copies it to the window,
+so the only cost of a window that nothing changed in is checking that nothing
+changed, and an exposed window is repaired without redrawing anything.
+
+NOTE: This draws each frame as soon as it's sent, so `present_fps` doesn't
+      apply, and there's nothing to interpolate. A predicted ball (see
+      `messages.predict`) is still drawn where it is when the frame is sent.
+
+NOTE: This only works on X11, and only imports `pong.windowing.linux` (rather
+      than going through `pong.windowing`) for that reason.
+"""
+
+from Xlib import X, Xatom
+
+from . import messages, render, scene, clock, trajectory
+from .windowing import WindowInfo, linux
+
+DEFAULT_FONT_NAME = 'fixed'
+
+
+def draw_circle(drawable, gc, circle, offset, font_info):
+    diameter = circle.radius * 2
+
+    drawable.fill_arc(
+        gc,
+        int(circle.position[0] - offset[0] - circle.radius),
+        int(circle.position[1] - offset[1] - circle.radius),
+        diameter,
+        diameter,
+        0,
+        360 * 64,
+    )
+
+
+def draw_rectangle(drawable, gc, rectangle, offset, font_info):
+    drawable.fill_rectangle(
+        gc,
+        int(rectangle.position[0] - offset[0]),
+        int(rectangle.position[1] - offset[1]),
+        rectangle.size[0],
+        rectangle.size[1],
+    )
+
+
+def draw_text(drawable, gc, text, offset, font_info):
+    # `Text`'s position is its top left corner, but X draws text from the
+    # left end of its baseline
+    drawable.draw_text(
+        gc,
+        int(text.position[0] - offset[0]),
+        int(text.position[1] - offset[1]) + font_info.font_ascent,
+        text.text,
+    )
+
+
+# How to draw each type of `Renderable`, taking (drawable, graphics context,
+# renderable, offset, font info)
+DRAWERS = {
+    render.Circle: draw_circle,
+    render.Rectangle: draw_rectangle,
+    render.Text: draw_text,
+}
+
+
+def draw_scene(drawable, gc, cur_scene, offset, font_info):
+    """
+    Draw every renderable in a scene, in white
+
+    :param drawable:  The Xlib `Drawable` to draw to
+    :param gc:        A `GC` for `drawable` with a white foreground
+    :param cur_scene: A scene dictionary (see `pong.scene`)
+    :param offset:    A two-element tuple of the drawable's position on screen
+    :param font_info: The `query` of `gc`'s font
+    """
+    for renderable in cur_scene.values():
+        DRAWERS[type(renderable)](drawable, gc, renderable, offset, font_info)
+
+
+class XWindow(object):
+    """
+    A game window drawn by this process, which quacks like the
+    `pong.channel.Channel` to a `GameProcess` running with the same
+    arguments.
+
+    :param game_process: The `GameProcess` this window replaces
+    """
+
+    game_process = None
+    handle = None
+
+    def __init__(self, game_process):
+        disp = linux.display()
+        screen = disp.screen()
+
+        width, height = game_process.size
+        position = game_process.position
+
+        if position is None and game_process.centered:
+            position = (
+                (screen.width_in_pixels - width) // 2,
+                (screen.height_in_pixels - height) // 2,
+            )
+
+        self.game_process = game_process
+
+        self._window = screen.root.create_window(
+            0, 0, width, height, 0,
+            screen.root_depth,
+            X.InputOutput,
+            X.CopyFromParent,
+            background_pixel=screen.black_pixel,
+            event_mask=X.ExposureMask | X.StructureNotifyMask,
+        )
+        self._window.set_wm_name('Pong')
+        self._delete_atom = disp.intern_atom('WM_DELETE_WINDOW')
+        self._window.change_property(
+            disp.intern_atom('WM_PROTOCOLS'),
+            Xatom.ATOM,
+            32,
+            [self._delete_atom],
+        )
+
+        self._pixmap = self._window.create_pixmap(
+            width,
+            height,
+            screen.root_depth,
+        )
+        font = disp.open_font(DEFAULT_FONT_NAME)
+        self._font_info = font.query()
+        self._fg = self._pixmap.create_gc(
+            foreground=screen.white_pixel,
+            background=screen.black_pixel,
+            font=font,
+        )
+        self._bg = self._pixmap.create_gc(foreground=screen.black_pixel)
+
+        self._window.map()
+        disp.flush()
+
+        self.handle = self._window.id
+        self._tracker = linux.tracker(self.handle)
+        linux.LISTENERS.append(self._handle_event)
+
+        if position is not None:
+            linux.set_translation(self.handle, position)
+
+        if game_process.pinned:
+            linux.pin_window(self.handle, position, fixed=True)
+
+        # Like `GameProcess`, this is the logical position of a frozen window
+        self._pin = None
+
+        self._scene = {}
+        self._prediction = None
+        self._path = None
+
+        self._drawn_scene = None
+        self._drawn_offset = None
+
+        self._reported = None
+        self._quit = False
+        self._closed = False
+
+    def _handle_event(self, event):
+        window = getattr(event, 'window', None)
+
+        if self._closed or window is None or window.id != self.handle:
+            return
+
+        if event.type == X.Expose and event.count == 0:
+            self._copy_to_window()
+        elif (
+            event.type == X.ClientMessage and
+            event.data[1][0] == self._delete_atom
+        ):
+            self._quit = True
+
+    def _copy_to_window(self):
+        width, height = self.game_process.size
+
+        self._pixmap.copy_area(
+            self._fg,
+            self._window,
+            0, 0, width, height,
+            0, 0,
+        )
+
+    def _handle(self, msg):
+        pinned = self.game_process.pinned
+
+        if messages.is_quit(msg):
+            self.close()
+        elif messages.is_timestamp(msg):
+            pass
+        elif messages.is_render(msg):
+            self._scene = scene.apply(self._scene, msg.info)
+        elif messages.is_predict(msg):
+            self._prediction = msg.info
+            self._path = trajectory.Trajectory(
+                position=msg.info.position,
+                direction=msg.info.direction,
+                speed=msg.info.speed,
+                play_area=msg.info.play_area,
+                start=msg.info.start,
+            )
+        elif messages.is_reset(msg):
+            if msg.info is not None:
+                linux.set_translation(self.handle, msg.info)
+
+                if pinned:
+                    linux.pin_window(self.handle, msg.info)
+
+            if not pinned:
+                self._pin = None
+                linux.unpin_window(self.handle)
+
+            self._scene = {}
+            self._prediction = self._path = None
+            self._drawn_scene = None
+        elif messages.is_freeze(msg):
+            if not self._pin and not pinned:
+                win_info = self._tracker.win_info()
+                self._pin = win_info.x, win_info.y
+                linux.pin_window(self.handle)
+        elif messages.is_unfreeze(msg):
+            if not pinned:
+                self._pin = None
+                linux.unpin_window(self.handle)
+        else:
+            print('Cannot interpret {}'.format(msg))
+            raise NotImplementedError()
+
+    def _present(self):
+        shown_scene = self._scene
+
+        if self._prediction is not None:
+            shown_scene = scene.follow(
+                shown_scene,
+                self._prediction.ball,
+                self._prediction.followers,
+                self._path.position_at(clock.monotonic()),
+            )
+
+        win_info = self._tracker.win_info()
+        offset = win_info.x, win_info.y
+
+        # The pixmap keeps what was drawn, so if neither the scene nor the
+        # window's position changed there's nothing to do
+        if shown_scene != self._drawn_scene or offset != self._drawn_offset:
+            width, height = self.game_process.size
+
+            self._pixmap.fill_rectangle(self._bg, 0, 0, width, height)
+            draw_scene(
+                self._pixmap,
+                self._fg,
+                shown_scene,
+                offset,
+                self._font_info,
+            )
+            self._copy_to_window()
+
+            self._drawn_scene = shown_scene
+            self._drawn_offset = offset
+
+        linux.enforce_pin(self.handle)
+        linux.display().flush()
+
+    def _state(self):
+        """
+        :return: The window's `WindowInfo`, at its logical position
+        """
+        win_info = self._tracker.win_info()
+
+        if self._pin is None:
+            return win_info
+
+        return WindowInfo(
+            x=self._pin[0],
+            y=self._pin[1],
+            width=win_info.width,
+            height=win_info.height,
+        )
+
+    def send(self, msgs):
+        if self._closed:
+            return
+
+        for msg in msgs:
+            self._handle(msg)
+
+            if self._closed:
+                return
+
+    def send_frame(self, msgs):
+        if self._closed:
+            return
+
+        self.send(msgs)
+
+        if not self._closed:
+            self._present()
+
+    def frame_pending(self):
+        # Frames are drawn as soon as they're sent
+        return False
+
+    def frames_dropped(self):
+        return 0
+
+    def full(self):
+        return False
+
+    def dropped(self):
+        return 0
+
+    def poll(self):
+        """
+        Whether the window has been asked to close, or has moved or resized
+        since the last `recv`
+        """
+        if self._closed:
+            return False
+
+        return self._quit or self._state() != self._reported
+
+    def recv(self):
+        if self._quit:
+            return messages.quit()
+
+        self._reported = self._state()
+
+        return messages.client_state(self._reported)
+
+    def recv_latest(self):
+        # There's only ever one thing to say
+        return self.recv()
+
+    def bell(self):
+        """
+        :return: The X connection, which is readable whenever there's an event
+                 that might change what `poll` says
+        """
+        return linux.display()
+
+    def close(self):
+        """
+        Destroy the window
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        linux.LISTENERS.remove(self._handle_event)
+        linux.TRACKERS.pop(self.handle, None)
+
+        self._pixmap.free()
+        self._window.destroy()
+        linux.display().flush()
+
+
+def open_windows(layout):
+    """
+    Open a window for each of a list of `GameProcess`es
+
+    :param layout: A list of `GameProcess`es (see `window_layout`)
+    :return:       A list of `XWindow`s
+    """
+    return [XWindow(game_process) for game_process in layout]